@@ -1,15 +1,34 @@
 # extractor_bajio_full.py
 # -*- coding: utf-8 -*-
 
+import logging
+import os
 import re
 import cv2
 import fitz  # PyMuPDF
 import numpy as np
 import pandas as pd
 import unicodedata
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 from statistics import median
-import easyocr
+try:
+    import pytesseract
+    TESSERACT_AVAILABLE = True
+except ImportError:
+    TESSERACT_AVAILABLE = False
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+from app.utils.ocr_common import (OCR_WORKERS, get_reader, map_page_chunks, ocr_pages_batched, ocr_scale,
+                                   only_digits)
+from app.utils.regex_trie import trie_regex
+
+logger = logging.getLogger(__name__)
 
 # Configuración
 ZOOM = 2.6
@@ -33,29 +52,71 @@ Y_PICK_TOL      = 26   # elegir token más cercano al ancla
 Y_DESC_ATTACH   = 60   # adjuntar detalle adicional
 ROW_VALIDATE_NEED_SALDO = False
 
+# Ancho máximo que se entrega a EasyOCR: el render conserva ZOOM, pero las páginas más
+# anchas que eso (formatos grandes) se reducen antes del detector
+OCR_MAX_WIDTH = 1600
+
+# Motor OCR: EasyOCR por defecto. Con BAJIO_OCR_ENGINE=tesseract se usa Tesseract (más rápido
+# en CPU para texto impreso) con EasyOCR como respaldo, siempre que el binario y el idioma
+# TESS_LANG estén instalados; si no, se queda EasyOCR
+TESS_LANG = "spa"
+TESS_CONFIG = "--psm 6"
+TESS_MIN_CONF = 0.60      # confianza media mínima de la página; si no, se repite con EasyOCR
+TESS_MERGE_GAP = 0.8      # une palabras de la misma línea si el hueco < gap * altura
+
+def _tesseract_ready() -> bool:
+    """True si pytesseract encuentra el binario de Tesseract y trae el idioma TESS_LANG."""
+    if not TESSERACT_AVAILABLE:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+        return TESS_LANG in pytesseract.get_languages(config="")
+    except (OSError, pytesseract.TesseractError):
+        return False
+
+OCR_ENGINE = "easyocr"
+if os.environ.get("BAJIO_OCR_ENGINE", "").lower() == "tesseract":
+    if _tesseract_ready():
+        OCR_ENGINE = "tesseract"
+    else:
+        logger.warning(f"⚠️ Tesseract ({TESS_LANG}) no disponible, Bajío usa EasyOCR")
+
 # Regex y normalizadores
-MONTOS_RX = re.compile(r'^\s*\(?-?\s*\$?\s*\d{1,3}(?:[ \u00A0\.,]?\d{3})*(?:[\.,]\d{2})\)?\s*$')
-EXTRACT_AMOUNT_RE = re.compile(r'(?<!\d)(\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2}))(?!\d)')
-RX_FECHA_NUM = re.compile(r'\b([0-3]?\d)[/.\-]([01]?\d)(?:[/.\-](\d{2,4}))?\b', re.I)
-RX_FECHA_MES = re.compile(r'\b([0-3]?\d)[\-/\. ]?([A-ZÁ]{3,})[\-/\. ]?(\d{2,4})?\b', re.I)
+MONTOS_RX = re.compile(r'^\s*\(?-?\s*\$?\s*[0-9]{1,3}(?:[ \u00A0\.,]?[0-9]{3})*(?:[\.,][0-9]{2})\)?\s*$')
+EXTRACT_AMOUNT_RE = re.compile(r'(?<![0-9])([0-9]{1,3}(?:[.,][0-9]{3})*(?:[.,][0-9]{2})|[0-9]+(?:[.,][0-9]{2}))(?![0-9])')
+# Se aplican sobre texto ya normalizado a mayúsculas: sin re.I
+RX_FECHA_NUM = re.compile(r'\b([0-3]?[0-9])[/.\-]([01]?[0-9])(?:[/.\-]([0-9]{2,4}))?\b')
+RX_FECHA_MES = re.compile(r'\b([0-3]?[0-9])[\-/\. ]?([A-ZÁ]{3,})[\-/\. ]?([0-9]{2,4})?\b')
 RX_FECHA_DMY_IN_DESC = re.compile(r"\b([0-3]?\d)[-/](ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[-/](\d{2,4})\b", re.I)
+# Un solo patrón para "¿parece fecha?": una pasada por token en lugar de tres búsquedas
+RX_PARECE_FECHA = re.compile("|".join(f"(?:{rx})" for rx in (
+    RX_FECHA_MES.pattern, RX_FECHA_NUM.pattern, r'\b(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)\b')))
+SOLO_NUMEROS_RX = re.compile(r'[\s\-\.,0-9]+')
 MESES = {"ENE":"ENE","FEB":"FEB","MAR":"MAR","ABR":"ABR","MAY":"MAY","JUN":"JUN",
          "JUL":"JUL","AGO":"AGO","SEP":"SEP","OCT":"OCT","NOV":"NOV","DIC":"DIC",
          "JAN":"ENE","APR":"ABR","AUG":"AGO","DEC":"DIC"}
 
-KEYWORDS_PUENTE = re.compile(r"CONTINUA EN LA SIGUIENTE PAGINA|ESTADO DE CUENTA", re.I)
+KEYWORDS_PUENTE = re.compile(trie_regex(["CONTINUA EN LA SIGUIENTE PAGINA", "ESTADO DE CUENTA"]), re.I)
+# Pistas para decidir DEPÓSITO vs RETIRO (se buscan sobre texto normalizado en mayúsculas)
+RETIRO_KEYWORDS_RX = re.compile(trie_regex(
+    ["CARGO","RETIRO","COMISION","COMISIÓN","IVA","ENVIO","ENVÍO","PAGO","TRANSFERENCIA"]))
+DEPOSITO_KEYWORDS_RX = re.compile(trie_regex(
+    ["ABONO","DEPOSITO","DEPÓSITO","RECIBIDO","TRASPASO","DEVOLUCION","DEVOLUCIÓN","SPEI RECIBIDO"]))
+_FECHA_TRANS = str.maketrans({".": " ", "-": " ", "/": " "})
 
+@lru_cache(maxsize=8192)
 def normalize_text(s: str) -> str:
     if not isinstance(s, str): return ""
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-    return re.sub(r"\s+", " ", s).strip()
+    if not s.isascii():  # ASCII no tiene acentos: se omite la descomposición NFD
+        s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    return " ".join(s.split())
 
+@lru_cache(maxsize=8192)
 def normalize_text_upper(s: str) -> str:
     return normalize_text(s).upper()
 
 def normalize_fecha(raw: str) -> str:
-    s = normalize_text_upper(raw).replace(".", " ").replace("-", " ").replace("/", " ")
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = " ".join(normalize_text_upper(raw).translate(_FECHA_TRANS).split())
     m = RX_FECHA_MES.search(s) or RX_FECHA_NUM.search(s)
     if not m: return raw.strip()
     dd = int(m.group(1))
@@ -74,7 +135,7 @@ def parse_amount_to_float(s):
     if s is None: return np.nan
     m = EXTRACT_AMOUNT_RE.search(str(s))
     if not m:
-        digits = ''.join(ch for ch in str(s) if ch.isdigit())
+        digits = only_digits(str(s))
         return float(digits) if digits else np.nan
     token = m.group(1)
     last_dot, last_comma = token.rfind('.'), token.rfind(',')
@@ -88,58 +149,75 @@ def parse_amount_to_float(s):
         return np.nan
 
 # Core helpers sirven para todas las extracciones
-def pdf_to_images_bgr(path: str, zoom: float = 2.0):
+def pdf_to_images_gray(path: str, zoom: float = 2.0, crop=None):
+    """Genera cada página en escala de grises (H×W uint8), una a la vez; con `crop`, sólo
+    crop(página). EasyOCR trabaja sobre gris para la detección, así evitamos la conversión
+    RGB→BGR y 2/3 del ancho de banda por página.
+    El pixmap de PyMuPDF se lee sin copia y sólo se copia lo que se entrega (la página o su
+    recorte) mientras el pixmap sigue vivo: el arreglo es del consumidor y el pixmap se libera
+    antes de renderizar la siguiente página."""
     doc = fitz.open(path)
-    imgs = []
-    for page in doc:
-        pm = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
-        arr = np.frombuffer(pm.samples, dtype=np.uint8).reshape(pm.h, pm.w, pm.n)
-        if pm.n == 3:
-            bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-        elif pm.n == 1:
-            bgr = cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
-        else:
-            bgr = cv2.cvtColor(arr[:, :, :3], cv2.COLOR_RGB2BGR)
-        imgs.append(bgr)
-    doc.close()
-    return imgs
-
-def x_center(bb): return (bb[0][0] + bb[2][0]) / 2.0
-def y_center(bb): return int((bb[0][1] + bb[2][1]) / 2)
-def in_xband(bb, xs, xe): return xs <= x_center(bb) < xe
-
-def tokens_by_col(results, cols):
-    out = {k: [] for k in cols.keys()}
-    for (bb, txt, _p) in results:
-        for col,(xs,xe) in cols.items():
-            if in_xband(bb, xs, xe):
-                out[col].append((bb, str(txt)))
-                break
+    try:
+        for page in doc:
+            pm = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+            view = np.frombuffer(pm.samples_mv, dtype=np.uint8).reshape(pm.h, pm.w)
+            img = (crop(view) if crop is not None else view).copy()
+            pm = view = None  # la vista no sobrevive a su pixmap
+            yield img
+    finally:
+        doc.close()
+
+def token_arrays(results):
+    """Tokens OCR como arreglos paralelos (SoA): x centro, y centro y textos."""
+    n = len(results)
+    pts = np.array([(bb[0][0], bb[0][1], bb[2][0], bb[2][1]) for (bb, _t, _p) in results],
+                   dtype=np.float64).reshape(n, 4)
+    xs = (pts[:, 0] + pts[:, 2]) / 2.0
+    ys = ((pts[:, 1] + pts[:, 3]) / 2).astype(np.int64)
+    texts = np.array([str(t) for (_bb, t, _p) in results], dtype=object)
+    return xs, ys, texts
+
+def tokens_by_col(xs, cols):
+    """Índices de token por columna; cada token va a la primera banda X que lo contiene."""
+    out = {}
+    libre = np.ones(len(xs), dtype=bool)
+    for col, (x0, x1) in cols.items():
+        m = libre & (xs >= x0) & (xs < x1)
+        out[col] = np.flatnonzero(m)
+        libre &= ~m
     return out
 
 def cluster_ys(y_values, tol):
-    if not y_values: return []
-    y_values = sorted(y_values)
-    clusters, cur = [], [y_values[0]]
-    for y in y_values[1:]:
-        if abs(y - cur[-1]) <= tol:
-            cur.append(y)
-        else:
-            clusters.append(int(median(cur)))
-            cur = [y]
-    clusters.append(int(median(cur)))
-    return clusters
-
-def pick_nearest(token_list, y0, tol):
-    if not token_list: return None
-    best, bestd = None, 10**9
-    for (bb, txt) in token_list:
-        yc = y_center(bb)
-        d = abs(yc - y0)
-        if d <= tol and d < bestd:
-            best = (bb, txt)
-            bestd = d
-    return best
+    if not len(y_values): return []
+    ys = np.sort(np.asarray(y_values, dtype=np.int64))
+    # Un corte donde el salto entre Y consecutivas supera la tolerancia
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ys) > tol) + 1))
+    ends = np.append(starts[1:], len(ys))
+    # Mediana exacta de cada tramo (ya ordenado)
+    n = ends - starts
+    hi = ys[starts + n // 2]
+    lo = ys[starts + (n - 1) // 2]
+    return ((lo + hi) / 2).astype(np.int64).tolist()
+
+def index_by_y(idxs, ys):
+    """Índice ordenado por Y de una columna: (índices, ys, orden, ys_ordenados)."""
+    col_ys = ys[idxs]
+    order = np.argsort(col_ys, kind="stable")
+    return idxs, col_ys, order, col_ys[order]
+
+def tokens_in_window(y_index, y0, tol):
+    """Índices globales (en orden original) de los tokens con |y - y0| <= tol y sus distancias."""
+    idxs, col_ys, order, ys_sorted = y_index
+    lo = np.searchsorted(ys_sorted, y0 - tol, side="left")
+    hi = np.searchsorted(ys_sorted, y0 + tol, side="right")
+    sel = np.sort(order[lo:hi])
+    return idxs[sel], np.abs(col_ys[sel] - y0)
+
+def pick_nearest(y_index, y0, tol):
+    """Índice global del token más cercano a y0 (o None)."""
+    idxs, dists = tokens_in_window(y_index, y0, tol)
+    if not len(idxs): return None
+    return int(idxs[np.argmin(dists)])
 
 # Corrección: mover NO.REF del inicio de la descripción (si está)
 LEADING_REF_RX = re.compile(r'^\s*(\d{6,})\b[\s\-:]*', re.U)
@@ -148,50 +226,127 @@ def _norm_ref(s: str) -> str:
     s = re.sub(r'\D', '', str(s or ''))
     return s if (len(s) >= 5 and s.lstrip('0') != '') else ""
 
-def move_ref_from_desc(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df["NO.REF"] = df["NO.REF"].apply(_norm_ref)
-
-    def fix_row(row):
-        desc_up = normalize_text_upper(row.get("DESCRIPCION DE LA OPERACION", "") or "")
-        # No tocar SALDO INICIAL
-        if "SALDO INICIAL" in desc_up:
-            return row
-
-        desc = str(row.get("DESCRIPCION DE LA OPERACION", "") or "").strip()
-        ref  = _norm_ref(row.get("NO.REF", ""))
-
-        if not ref:
-            m = LEADING_REF_RX.match(desc)  # sólo si está AL INICIO
-            if m:
-                ref = m.group(1)
-                row["NO.REF"] = ref
-                new_desc = desc[m.end():].lstrip()
-                new_desc = re.sub(rf'\b{re.escape(ref)}\b', ' ', new_desc)  # borra repeticiones exactas
-                new_desc = re.sub(r'\s{2,}', ' ', new_desc).strip(" ·-,:;")
-                row["DESCRIPCION DE LA OPERACION"] = new_desc
-
-        return row
+def move_ref_from_desc(ref: str, desc: str):
+    """Si la fila no trae NO.REF y la descripción empieza con uno, lo mueve a NO.REF.
+    Devuelve (ref, desc)."""
+    ref = _norm_ref(ref)
+    # No tocar SALDO INICIAL
+    if ref or "SALDO INICIAL" in normalize_text_upper(desc):
+        return ref, desc
 
-    return df.apply(fix_row, axis=1)
+    m = LEADING_REF_RX.match(desc.strip())  # sólo si está AL INICIO
+    if not m:
+        return ref, desc
+    ref = m.group(1)
+    new_desc = desc.strip()[m.end():].lstrip()
+    new_desc = re.sub(rf'\b{re.escape(ref)}\b', ' ', new_desc)  # borra repeticiones exactas
+    return ref, re.sub(r'\s{2,}', ' ', new_desc).strip(" ·-,:;")
+
+# Inferencia de saldo por continuidad
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _infer_saldos_nb(saldo, dep, ret):
+        # Escribe en `saldo` mismo: cada posición se lee antes de rellenarse
+        prev = np.nan
+        for i in range(saldo.shape[0]):
+            if not np.isnan(saldo[i]):
+                prev = saldo[i]
+                continue
+            if not np.isnan(prev):
+                if not np.isnan(dep[i]):
+                    prev = prev + dep[i]
+                elif not np.isnan(ret[i]):
+                    prev = prev - ret[i]
+                saldo[i] = prev
+
+def infer_saldos(df: pd.DataFrame) -> pd.DataFrame:
+    """Rellena SALDO vacío con el saldo anterior + depósito - retiro (en sitio)."""
+    dep = df["DEPOSITOS"].to_numpy(dtype="float64")
+    ret = df["RETIROS"].to_numpy(dtype="float64")
+    if NUMBA_AVAILABLE:
+        sal = df["SALDO"].to_numpy(dtype="float64", copy=True)
+        _infer_saldos_nb(sal, dep, ret)
+        df["SALDO"] = sal
+        return df
+    # Sin numba: cada SALDO conocido abre un tramo; dentro del tramo el saldo es la suma
+    # acumulada de ancla + depósitos - retiros.
+    sal_s = df["SALDO"]
+    tramo = sal_s.notna().cumsum()
+    delta = pd.Series(np.where(~np.isnan(dep), dep, np.where(~np.isnan(ret), -ret, 0.0)), index=df.index)
+    acumulado = sal_s.where(sal_s.notna(), delta).groupby(tramo).cumsum()
+    df["SALDO"] = sal_s.where(sal_s.notna(), acumulado.where(tramo > 0))
+    return df
 
 # =========================
 # Extraction
 # =========================
-def extract_page(img_bgr, page_idx, reader):
-    crop = img_bgr[TOP_CROP: img_bgr.shape[0]-BOTTOM_CROP, :]
-    results = reader.readtext(crop, detail=1, paragraph=False)
-
+def crop_page(img):
+    return img[TOP_CROP: img.shape[0]-BOTTOM_CROP, :]
+
+def _tess_phrase(words):
+    x0 = min(w[0] for w in words); y0 = min(w[1] for w in words)
+    x1 = max(w[0] + w[2] for w in words); y1 = max(w[1] + w[3] for w in words)
+    txt = " ".join(w[4] for w in words)
+    conf = sum(w[5] for w in words) / len(words) / 100.0
+    return ([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], txt, conf)
+
+def ocr_page_tesseract(crop):
+    """OCR con Tesseract devuelto en el formato de EasyOCR: [(bbox, texto, confianza)].
+    Tesseract entrega palabras; se unen en frases por línea (como paragraph=False en EasyOCR)."""
+    data = pytesseract.image_to_data(crop, lang=TESS_LANG, config=TESS_CONFIG,
+                                     output_type=pytesseract.Output.DICT)
+    lines = {}
+    for i, txt in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        txt = str(txt).strip()
+        if conf < 0 or not txt:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(
+            (data["left"][i], data["top"][i], data["width"][i], data["height"][i], txt, conf))
+
+    results = []
+    for words in lines.values():
+        words.sort(key=lambda w: w[0])
+        cur = [words[0]]
+        for w in words[1:]:
+            prev = cur[-1]
+            if w[0] - (prev[0] + prev[2]) <= TESS_MERGE_GAP * max(w[3], prev[3]):
+                cur.append(w)
+            else:
+                results.append(_tess_phrase(cur)); cur = [w]
+        results.append(_tess_phrase(cur))
+    return results
+
+def ocr_pages_easyocr(crops):
+    """OCR en lote con EasyOCR; los recortes más anchos que OCR_MAX_WIDTH se reducen antes."""
+    return ocr_pages_batched(crops, get_reader(),
+                             scales=[ocr_scale(c, max_width=OCR_MAX_WIDTH) for c in crops])
+
+def ocr_pages(crops):
+    """OCR de un bloque de páginas con el motor configurado.
+    Con Tesseract, las páginas de baja confianza se repiten en lote con EasyOCR."""
+    if OCR_ENGINE != "tesseract":
+        return ocr_pages_easyocr(crops)
+    results_list = [ocr_page_tesseract(c) for c in crops]
+    low = [k for k, res in enumerate(results_list)
+           if not res or sum(r[2] for r in res) / len(res) < TESS_MIN_CONF]
+    if low:
+        for k, res in zip(low, ocr_pages_easyocr([crops[k] for k in low])):
+            results_list[k] = res
+    return results_list
+
+def extract_page(results, page_idx):
     # Organiza por columnas
-    coltok = tokens_by_col(results, COLS)
+    xs, ys, texts = token_arrays(results)
+    coltok = tokens_by_col(xs, COLS)
 
     # Anclas: cualquier monto en DEPOSITOS/RETIROS/SALDO
     anchors_y = []
     for col in ("DEPOSITOS", "RETIROS", "SALDO"):
-        for (bb, txt) in coltok[col]:
-            s = txt.replace(" ", "")
-            if MONTOS_RX.match(s):
-                anchors_y.append(y_center(bb))
+        for i in coltok[col].tolist():
+            if MONTOS_RX.match(texts[i].replace(" ", "")):
+                anchors_y.append(ys[i])
 
     if not anchors_y:
         return pd.DataFrame(columns=["FECHA","NO.REF","DESCRIPCION DE LA OPERACION","DEPOSITOS","RETIROS","SALDO"])
@@ -200,198 +355,167 @@ def extract_page(img_bgr, page_idx, reader):
 
     rows = []
     used_descr_idxs = set()
-    descr_tokens = list(enumerate(coltok["DESCRIP"]))
+    y_idx = {col: index_by_y(idxs, ys) for col, idxs in coltok.items()}
+    y_tol_fecha = max(Y_PICK_TOL, 28)
 
     last_fecha_seen = ""
+    last_fecha_amt = ""
+    keep = []
     for y0 in row_ys:
-        dep_t = pick_nearest(coltok["DEPOSITOS"], y0, Y_PICK_TOL)
-        ret_t = pick_nearest(coltok["RETIROS"],   y0, Y_PICK_TOL)
-        sal_t = pick_nearest(coltok["SALDO"],     y0, Y_PICK_TOL)
+        dep_i = pick_nearest(y_idx["DEPOSITOS"], y0, Y_PICK_TOL)
+        ret_i = pick_nearest(y_idx["RETIROS"],   y0, Y_PICK_TOL)
+        sal_i = pick_nearest(y_idx["SALDO"],     y0, Y_PICK_TOL)
 
-        dep = dep_t[1].strip() if dep_t else ""
-        ret = ret_t[1].strip() if ret_t else ""
-        sal = sal_t[1].strip() if sal_t else ""
+        dep = texts[dep_i].strip() if dep_i is not None else ""
+        ret = texts[ret_i].strip() if ret_i is not None else ""
+        sal = texts[sal_i].strip() if sal_i is not None else ""
         if not (dep or ret or sal): continue
 
-        if sal_t: y_anchor = y_center(sal_t[0])
-        elif dep_t and ret_t: y_anchor = int(median([y_center(dep_t[0]), y_center(ret_t[0])]))
-        elif dep_t: y_anchor = y_center(dep_t[0])
-        elif ret_t: y_anchor = y_center(ret_t[0])
+        if sal_i is not None: y_anchor = int(ys[sal_i])
+        elif dep_i is not None and ret_i is not None: y_anchor = int(median([ys[dep_i], ys[ret_i]]))
+        elif dep_i is not None: y_anchor = int(ys[dep_i])
+        elif ret_i is not None: y_anchor = int(ys[ret_i])
         else: y_anchor = y0
 
-        # FECHA
+        # FECHA (la más cercana que parezca fecha; empate -> orden original)
         fecha_pick = ""
-        cand_fechas = []
-        for (bb, txt) in coltok["FECHA"]:
-            yc = y_center(bb)
-            if abs(yc - y_anchor) <= max(Y_PICK_TOL, 28):
-                n = normalize_text_upper(txt)
-                if RX_FECHA_MES.search(n) or RX_FECHA_NUM.search(n) or re.search(r'\b(ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)\b', n):
-                    cand_fechas.append((abs(yc - y_anchor), txt))
-        if cand_fechas:
-            cand_fechas.sort(key=lambda t: t[0])
-            fecha_pick = normalize_fecha(cand_fechas[0][1])
+        best_d = None
+        for j, d in zip(*tokens_in_window(y_idx["FECHA"], y_anchor, y_tol_fecha)):
+            if best_d is not None and d >= best_d:
+                continue
+            txt = texts[j]
+            n = normalize_text_upper(txt)
+            if RX_PARECE_FECHA.search(n):
+                fecha_pick, best_d = txt, d
+        if best_d is not None:
+            fecha_pick = normalize_fecha(fecha_pick)
             last_fecha_seen = fecha_pick
         else:
             fecha_pick = last_fecha_seen
 
         # NO.REF cercano
         noref_pick = ""
-        cand_ref = []
-        for (bb, txt) in coltok["NOREF"]:
-            yc = y_center(bb)
-            if abs(yc - y_anchor) <= max(Y_PICK_TOL, 28):
-                cand_ref.append((abs(yc - y_anchor), txt))
-        if cand_ref:
-            cand_ref.sort(key=lambda t: t[0])
-            raw = cand_ref[0][1]
-            raw = raw.replace("O","0").replace("o","0")
-            noref_pick = ''.join(ch for ch in raw if ch.isdigit())
+        ref_i = pick_nearest(y_idx["NOREF"], y_anchor, y_tol_fecha)
+        if ref_i is not None:
+            raw = texts[ref_i].replace("O","0").replace("o","0")
+            noref_pick = only_digits(raw)
 
         # DESCRIP principal + detalle cercano
         descr_pick = ""
-        dists = []
-        for idx,(bb, txt) in descr_tokens:
-            yc = y_center(bb)
-            d = abs(yc - y_anchor)
-            if d <= Y_PICK_TOL:
-                dists.append((d, idx, txt))
-        if dists:
-            dists.sort(key=lambda t: t[0])
-            descr_pick = normalize_text(dists[0][2])
-            used_descr_idxs.add(dists[0][1])
+        idxs, dists = tokens_in_window(y_idx["DESCRIP"], y_anchor, Y_PICK_TOL)
+        if len(idxs):
+            j = int(idxs[np.argmin(dists)])
+            descr_pick = normalize_text(texts[j])
+            used_descr_idxs.add(j)
 
         more = []
-        for idx,(bb, txt) in descr_tokens:
-            if idx in used_descr_idxs: 
+        idxs, _dists = tokens_in_window(y_idx["DESCRIP"], y_anchor, Y_DESC_ATTACH)
+        for idx in idxs.tolist():
+            if idx in used_descr_idxs:
+                continue
+            tnorm = normalize_text(texts[idx])
+            if KEYWORDS_PUENTE.search(tnorm):  # evita cabeceras
                 continue
-            yc = y_center(bb)
-            d = abs(yc - y_anchor)
-            if d <= Y_DESC_ATTACH:
-                tnorm = normalize_text(txt)
-                if KEYWORDS_PUENTE.search(tnorm):  # evita cabeceras
-                    continue
-                if re.fullmatch(r'[\s\-\.,0-9]+', tnorm or ""):
-                    continue
-                if tnorm and tnorm != descr_pick:
-                    more.append(tnorm)
-                    used_descr_idxs.add(idx)
+            if SOLO_NUMEROS_RX.fullmatch(tnorm or ""):
+                continue
+            if tnorm and tnorm != descr_pick:
+                more.append(tnorm)
+                used_descr_idxs.add(idx)
         if more:
             descr_pick = (descr_pick + " · " + " · ".join(more)).strip(" ·")
 
+        # ---- Limpiezas de la fila ----
+        dep_v = parse_amount_to_float(dep)
+        ret_v = parse_amount_to_float(ret)
+        sal_v = parse_amount_to_float(sal)
+        dep_ok, ret_ok, sal_ok = dep_v == dep_v, ret_v == ret_v, sal_v == sal_v  # no NaN
+
+        # Fecha incrustada en la descripción (sólo si la fila no trae FECHA)
+        if not fecha_pick:
+            m = RX_FECHA_DMY_IN_DESC.search(descr_pick)
+            if m:
+                fecha_pick = normalize_fecha(m.group(0))
+                descr_pick = " ".join(RX_FECHA_DMY_IN_DESC.sub(" ", descr_pick).split()).strip(" -,:;")
+
+        # Forward-fill de FECHA en filas con importes
+        if dep_ok or ret_ok or sal_ok:
+            if fecha_pick:
+                last_fecha_amt = fecha_pick
+            else:
+                fecha_pick = last_fecha_amt or np.nan
+
+        # Exclusividad DEP vs RET
+        if dep_ok and ret_ok:
+            desc_up = normalize_text_upper(descr_pick)
+            if RETIRO_KEYWORDS_RX.search(desc_up):
+                dep_v = np.nan
+            elif DEPOSITO_KEYWORDS_RX.search(desc_up):
+                ret_v = np.nan
+            elif dep_v >= ret_v:
+                ret_v = np.nan
+            else:
+                dep_v = np.nan
+            dep_ok, ret_ok = dep_v == dep_v, ret_v == ret_v
+
+        # NO.REF al inicio de la descripción
+        noref_pick, descr_pick = move_ref_from_desc(noref_pick, descr_pick)
+
+        # Quita puentes/cabeceras y validación mínima
+        if KEYWORDS_PUENTE.search(descr_pick):
+            ok = False
+        elif "SALDO INICIAL" in normalize_text_upper(descr_pick):
+            ok = sal_ok
+        else:
+            fecha_ok = isinstance(fecha_pick, str) and fecha_pick.strip() != ""
+            ok = fecha_ok and ((dep_ok != ret_ok) or sal_ok) and (sal_ok or not ROW_VALIDATE_NEED_SALDO)
+
         rows.append({
             "FECHA": fecha_pick,
-            "NO.REF": noref_pick,
+            "NO.REF": noref_pick or np.nan,
             "DESCRIPCION DE LA OPERACION": descr_pick,
-            "DEPOSITOS": dep,
-            "RETIROS": ret,
-            "SALDO": sal,
+            "DEPOSITOS": dep_v,
+            "RETIROS": ret_v,
+            "SALDO": sal_v,
         })
+        keep.append(ok)
 
-    # ---- DataFrame y limpiezas ----
+    # ---- DataFrame ----
     if not rows:
         return pd.DataFrame(columns=["FECHA","NO.REF","DESCRIPCION DE LA OPERACION","DEPOSITOS","RETIROS","SALDO"])
 
     df = pd.DataFrame(rows, columns=["FECHA","NO.REF","DESCRIPCION DE LA OPERACION","DEPOSITOS","RETIROS","SALDO"])
 
-    # Normaliza importes
-    for c in ["DEPOSITOS","RETIROS","SALDO"]:
-        df[c] = df[c].apply(parse_amount_to_float)
-
-    # Mueve fechas incrustadas en descripción
-    def pull_date_from_desc(row):
-        desc = row.get("DESCRIPCION DE LA OPERACION", "")
-        if isinstance(desc, str) and desc:
-            m = RX_FECHA_DMY_IN_DESC.search(desc)
-            if m and not row.get("FECHA"):
-                try:
-                    row["FECHA"] = normalize_fecha(m.group(0))
-                except Exception:
-                    pass
-                desc = RX_FECHA_DMY_IN_DESC.sub(" ", desc)
-                row["DESCRIPCION DE LA OPERACION"] = re.sub(r"\s+", " ", desc).strip(" -,:;")
-        return row
-    df = df.apply(pull_date_from_desc, axis=1)
-
-    # Forward-fill de FECHA cuando haya importes
-    mask_amt = df[["DEPOSITOS","RETIROS","SALDO"]].notna().any(axis=1)
-    df.loc[mask_amt, "FECHA"] = (
-        df.loc[mask_amt, "FECHA"].replace(r'^\s*$', np.nan, regex=True).ffill()
-    )
-
-    # Exclusividad DEP vs RET
-    def enforce_one_amount(row):
-        dep, ret = row["DEPOSITOS"], row["RETIROS"]
-        if pd.notna(dep) and pd.notna(ret):
-            desc = normalize_text_upper(row.get("DESCRIPCION DE LA OPERACION", ""))
-            if any(w in desc for w in ("CARGO","RETIRO","COMISION","COMISIÓN","IVA","ENVIO","ENVÍO","PAGO","TRANSFERENCIA")):
-                row["DEPOSITOS"] = np.nan
-            elif any(w in desc for w in ("ABONO","DEPOSITO","DEPÓSITO","RECIBIDO","TRASPASO","DEVOLUCION","DEVOLUCIÓN","SPEI RECIBIDO")):
-                row["RETIROS"] = np.nan
-            else:
-                try:
-                    if float(dep) >= float(ret): row["RETIROS"] = np.nan
-                    else:                         row["DEPOSITOS"] = np.nan
-                except Exception:
-                    row["DEPOSITOS"] = np.nan
-        return row
-    df = df.apply(enforce_one_amount, axis=1)
-
-    # === NUEVO: mover NO.REF del inicio de la descripción ===
-    df = move_ref_from_desc(df)
-
-    # Limpiar NO.REF final
-    def clean_ref(s):
-        if not s: return ""
-        s = str(s).replace("O","0").replace("o","0")
-        return ''.join(ch for ch in s if ch.isdigit())
-    df["NO.REF"] = df["NO.REF"].apply(clean_ref)
-
     # (Opcional) ffill prudente de NO.REF dentro del mismo día
-    df["NO.REF"] = df["NO.REF"].replace("", np.nan)
     df["NO.REF"] = df.groupby(df["FECHA"].ffill())["NO.REF"].ffill()
     df["NO.REF"] = df["NO.REF"].fillna("")
 
-    # Quita puentes/cabeceras
-    df = df[~df["DESCRIPCION DE LA OPERACION"].astype(str).str.contains(KEYWORDS_PUENTE)].reset_index(drop=True)
+    df = df[np.array(keep, dtype=bool)].reset_index(drop=True)
 
-    # Validación mínima
-    valid = []
-    for _, r in df.iterrows():
-        desc = normalize_text_upper(r.get("DESCRIPCION DE LA OPERACION",""))
-        is_saldo_inicial = "SALDO INICIAL" in desc
-        fecha_ok  = isinstance(r["FECHA"], str) and r["FECHA"].strip() != ""
-        one_amt   = (pd.notna(r["DEPOSITOS"]) ^ pd.notna(r["RETIROS"]))
-        saldo_ok  = pd.notna(r["SALDO"]) or (not ROW_VALIDATE_NEED_SALDO)
+    # Inferencia de saldo por continuidad
+    return infer_saldos(df)
+
+# Columnas del DataFrame -> claves del movimiento estándar (en orden de salida)
+MOVIMIENTO_COLS = {
+    "FECHA": "fecha",
+    "DESCRIPCION DE LA OPERACION": "concepto",
+    "NO.REF": "referencia",
+    "RETIROS": "cargos",
+    "DEPOSITOS": "abonos",
+    "SALDO": "saldo",
+}
 
-        if is_saldo_inicial:
-            if pd.notna(r["SALDO"]): valid.append(r)
-        else:
-            if fecha_ok and (one_amt or pd.notna(r["SALDO"])) and saldo_ok:
-                valid.append(r)
-    df = pd.DataFrame(valid, columns=df.columns)
+# =========================
+# OCR en paralelo por bloques de páginas
+# =========================
+def _ocr_extract_chunk(first_page, crops):
+    """OCR en lote + extracción de un bloque contiguo de páginas."""
+    results_list = ocr_pages(crops)
+    return [extract_page(results, first_page + k) for k, results in enumerate(results_list)]
 
-    # Inferencia de saldo por continuidad
-    def infer_saldos(df_in):
-        df_in = df_in.copy()
-        prev = np.nan
-        for i, r in df_in.iterrows():
-            sal, dep, ret = r["SALDO"], r["DEPOSITOS"], r["RETIROS"]
-            if pd.notna(sal):
-                prev = sal; continue
-            if pd.notna(prev):
-                try:
-                    if pd.notna(dep): sal = prev + float(dep)
-                    elif pd.notna(ret): sal = prev - float(ret)
-                    else: sal = prev
-                    df_in.at[i, "SALDO"] = sal
-                    prev = sal
-                except Exception:
-                    pass
-        return df_in
-    df = infer_saldos(df)
-
-    return df.reset_index(drop=True)
+def ocr_extract_pages(crops, workers: Optional[int] = None):
+    """Devuelve un DataFrame por página, en el mismo orden que `crops`.
+    Con varios workers reparte bloques contiguos de páginas entre procesos."""
+    return map_page_chunks(_ocr_extract_chunk, crops, workers=workers or OCR_WORKERS)
 
 # =========================
 # MAIN
@@ -409,15 +533,13 @@ def process_bajio_pdf(pdf_path_in: str, save_debug: bool = False) -> dict:
         if save_debug:
             out_dir.mkdir(parents=True, exist_ok=True)
 
-        pages = pdf_to_images_bgr(pdf_path_in, zoom=ZOOM)
-        reader = easyocr.Reader(['es'], gpu=False)
+        # Sólo se conserva (copia) el recorte útil; el pixmap completo se libera por página
+        crops = list(pdf_to_images_gray(pdf_path_in, zoom=ZOOM, crop=crop_page))
 
-        all_rows = []
-        for i, img in enumerate(pages, start=1):
-            if save_debug:
+        if save_debug:
+            for i, crop in enumerate(crops, start=1):
                 # Guardar overlay simple de columnas para inspección
-                crop = img[TOP_CROP: img.shape[0]-BOTTOM_CROP, :]
-                ov = crop.copy()
+                ov = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
                 h, _w = ov.shape[:2]
                 colors = {
                     "FECHA": (255,0,0), "NOREF": (0,255,255), "DESCRIP": (0,200,0),
@@ -428,7 +550,9 @@ def process_bajio_pdf(pdf_path_in: str, save_debug: bool = False) -> dict:
                     cv2.line(ov, (int(xe),0), (int(xe),h), colors[k], 1)
                 cv2.imwrite(str(out_dir / f"p{i:03d}_cols_overlay.png"), ov)
 
-            dfp = extract_page(img, i, reader)
+        # OCR (en lote y repartido entre procesos) + extracción por página
+        all_rows = []
+        for i, dfp in enumerate(ocr_extract_pages(crops), start=1):
             if not dfp.empty:
                 dfp["PAGINA"] = i
                 all_rows.append(dfp)
@@ -438,38 +562,11 @@ def process_bajio_pdf(pdf_path_in: str, save_debug: bool = False) -> dict:
         else:
             df = pd.DataFrame(columns=["FECHA","NO.REF","DESCRIPCION DE LA OPERACION","DEPOSITOS","RETIROS","SALDO","PAGINA"])
 
-        df = df.reset_index(drop=True)
-
-        # Mapear DataFrame a formato estándar de movimientos
-        movimientos = []
-        for _, row in df.iterrows():
-            fecha = row.get("FECHA", "")
-            concepto = row.get("DESCRIPCION DE LA OPERACION", "")
-            referencia = row.get("NO.REF", "")
-            dep = row.get("DEPOSITOS")
-            ret = row.get("RETIROS")
-            sal = row.get("SALDO")
-            try:
-                cargos = float(ret) if pd.notna(ret) else None
-            except Exception:
-                cargos = None
-            try:
-                abonos = float(dep) if pd.notna(dep) else None
-            except Exception:
-                abonos = None
-            try:
-                saldo = float(sal) if pd.notna(sal) else None
-            except Exception:
-                saldo = None
-
-            movimientos.append({
-                'fecha': fecha,
-                'concepto': concepto,
-                'referencia': str(referencia) if referencia is not None else '',
-                'cargos': cargos,
-                'abonos': abonos,
-                'saldo': saldo,
-            })
+        # Mapear DataFrame a formato estándar de movimientos (NaN -> None)
+        df = df[list(MOVIMIENTO_COLS)].rename(columns=MOVIMIENTO_COLS)
+        df[["cargos", "abonos", "saldo"]] = df[["cargos", "abonos", "saldo"]].astype("float64")
+        df = df.astype(object)
+        movimientos = df.where(df.notna(), None).to_dict(orient="records")
 
         return {
             'exito': True,
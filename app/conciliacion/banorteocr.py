@@ -1,5 +1,5 @@
+import os
 import cv2
-import easyocr
 import re
 import numpy as np
 import fitz  # PyMuPDF
@@ -10,10 +10,20 @@ except ImportError:
     MATPLOTLIB_AVAILABLE = False
 from pathlib import Path
 import unicodedata
-from statistics import median
+from functools import lru_cache
 import pandas as pd
 from typing import Optional
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+from app.utils.ocr_common import (OCR_WORKERS, get_reader, map_page_chunks, ocr_pages_batched, ocr_scale,
+                                   only_digits)
+from app.utils.regex_trie import trie_regex
+
 # =========================
 # CONFIG
 # =========================
@@ -36,6 +46,25 @@ MANUAL_COL_RANGES = {
     "SALDO":     (1240, 1500),
 }
 
+# Escala adaptativa para el OCR: se renderiza a ZOOM y, si las líneas de texto miden más de
+# OCR_TARGET_LINE_H px, el recorte se reduce (nunca por debajo de OCR_MIN_SCALE) sólo para el
+# reconocedor. Las cajas se devuelven en coordenadas del recorte original, así que
+# MANUAL_COL_RANGES y los umbrales en px de extract_page siguen valiendo tal cual.
+OCR_TARGET_LINE_H = 18
+OCR_MIN_SCALE = 0.5
+
+# T-API: con OpenCL disponible, el umbral y la proyección de detect_row_bands van en UMat
+# (iGPU/dGPU); sin OpenCL se usan ndarrays normales. Se consulta en cada proceso al primer
+# uso (ver _opencl_available), no al importar: un contexto OpenCL no sobrevive a un fork
+_OPENCL_POR_PID = {}
+
+def _opencl_available() -> bool:
+    """cv2.ocl.haveOpenCL() del proceso actual, consultado una vez por proceso."""
+    pid = os.getpid()
+    if pid not in _OPENCL_POR_PID:
+        _OPENCL_POR_PID[pid] = cv2.ocl.haveOpenCL()
+    return _OPENCL_POR_PID[pid]
+
 # Gate: exige TODAS las cabeceras (5/5) y en MAYÚSCULAS
 REQUIRE_ALL_HEADERS = True
 
@@ -53,8 +82,10 @@ COLORS = {
 }
 
 ROW_Y_TOL = 16
-MONTOS_RX = re.compile(r'^\s*-?\d{1,3}(?:[ ,]?\d{3})*(?:\.\d{2})\s*$')
-EXTRACT_AMOUNT_RE = re.compile(r'(?<!\d)(\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2}))(?!\d)')
+MONTOS_RX = re.compile(r'^\s*-?[0-9]{1,3}(?:[ ,]?[0-9]{3})*(?:\.[0-9]{2})\s*$')
+# Forma habitual de los montos Banorte ("1,234.56" / "1234.56"): se convierte sin EXTRACT_AMOUNT_RE
+_FAST_AMOUNT = re.compile(r'[0-9]{1,3}(?:,[0-9]{3})*\.[0-9]{2}|[0-9]+\.[0-9]{2}')
+EXTRACT_AMOUNT_RE = re.compile(r'(?<![0-9])([0-9]{1,3}(?:[.,][0-9]{3})*(?:[.,][0-9]{2})|[0-9]+(?:[.,][0-9]{2}))(?![0-9])')
 
 # =========================
 # Utilidades
@@ -64,31 +95,42 @@ def pdf_to_images_bgr(path: str, zoom: float = 2.0) -> list:
     imgs = []
     for page in doc:
         pm = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
-        arr = np.frombuffer(pm.samples, dtype=np.uint8).reshape(pm.h, pm.w, pm.n)
+        # Vista sin copia sobre el buffer del pixmap (válida mientras viva pm); cvtColor hace
+        # la única copia (ya en BGR) antes de soltar el pixmap
+        arr = np.frombuffer(pm.samples_mv, dtype=np.uint8).reshape(pm.h, pm.w, pm.n)
         if pm.n == 3:
             bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
         elif pm.n == 1:
             bgr = cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
         else:
-            bgr = cv2.cvtColor(arr[:, :, :3], cv2.COLOR_RGB2BGR)
+            bgr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
         imgs.append(bgr)
+        pm = arr = None  # libera el pixmap antes de renderizar la siguiente página
     doc.close()
     return imgs
 
 def x_center(bb):
     return (bb[0][0] + bb[2][0]) / 2.0
 
-def y_center(bb):
-    return int((bb[0][1] + bb[2][1]) / 2)
-
 def in_band_center(bb, xs, xe):
     xc = x_center(bb)
     return xs <= xc < xe
 
-def normalize_text(s: str) -> str:
+# Los tokens OCR (cabeceras, conceptos, fechas) se repiten entre filas y páginas: normalize_text y
+# normalize_fecha se memorizan, pero sólo para cadenas de hasta CACHE_MAX_LEN caracteres
+CACHE_MAX_LEN = 80
+
+def _normalize_text(s: str) -> str:
+    if s.isascii():  # ASCII no tiene acentos: se omite la descomposición NFD
+        return s.upper().strip()
     s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
     return s.upper().strip()
 
+_normalize_text_cached = lru_cache(maxsize=8192)(_normalize_text)
+
+def normalize_text(s: str) -> str:
+    return _normalize_text_cached(s) if len(s) <= CACHE_MAX_LEN else _normalize_text(s)
+
 def is_all_caps_raw(s: str) -> bool:
     no_acc = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
     has_alpha = any(ch.isalpha() for ch in no_acc)
@@ -117,8 +159,9 @@ def detect_headers_uppercase(results):
     return found, matches
 
 # -------- Fechas (amplias) --------
-RX_FECHA_MES = re.compile(r'\b([0-3]?\d)[\-/\. ]?([A-ZÁ]{3,})[\-/\. ]?(\d{2,4})?\b', re.I)
-RX_FECHA_NUM = re.compile(r'\b([0-3]?\d)[/.\-]([01]?\d)(?:[/.\-](\d{2,4}))?\b', re.I)
+# Se aplican sobre texto ya normalizado a mayúsculas: sin re.I
+RX_FECHA_MES = re.compile(r'\b([0-3]?[0-9])[\-/\. ]?([A-ZÁ]{3,})[\-/\. ]?([0-9]{2,4})?\b')
+RX_FECHA_NUM = re.compile(r'\b([0-3]?[0-9])[/.\-]([01]?[0-9])(?:[/.\-]([0-9]{2,4}))?\b')
 MESES = {"ENE":"ENE","FEB":"FEB","MAR":"MAR","ABR":"ABR","MAY":"MAY","JUN":"JUN",
          "JUL":"JUL","AGO":"AGO","SEP":"SEP","OCT":"OCT","NOV":"NOV","DIC":"DIC",
          "JAN":"ENE","APR":"ABR","AUG":"AGO","DEC":"DIC"}
@@ -126,9 +169,16 @@ MESES = {"ENE":"ENE","FEB":"FEB","MAR":"MAR","ABR":"ABR","MAY":"MAY","JUN":"JUN"
 # Fechas embebidas en descripción tipo "15-ENE-23" o "15/ENE/23"
 RX_FECHA_DMY_IN_DESC = re.compile(r"\b([0-3]?\d)[-/](ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[-/](\d{2,4})\b", re.I)
 
-def normalize_fecha(raw: str) -> str:
-    s = normalize_text(raw).replace(".", " ").replace("-", " ").replace("/", " ")
-    s = re.sub(r'\s+', ' ', s).strip()
+# Pistas para decidir DEPÓSITO vs RETIRO (se buscan sobre texto normalizado en mayúsculas)
+RETIRO_KEYWORDS_RX = re.compile(trie_regex(
+    ["CARGO","RETIRO","COMISION","COMISIÓN","IVA","ENVIO","ENVÍO","PAGO","TRANSFERENCIA"]))
+DEPOSITO_KEYWORDS_RX = re.compile(trie_regex(
+    ["ABONO","DEPOSITO","DEPÓSITO","RECIBIDO","TRASPASO","DEVOLUCION","DEVOLUCIÓN","SPEI RECIBIDO"]))
+
+_FECHA_TRANS = str.maketrans({".": " ", "-": " ", "/": " "})
+
+def _normalize_fecha(raw: str) -> str:
+    s = " ".join(normalize_text(raw).translate(_FECHA_TRANS).split())
     m = RX_FECHA_MES.search(s) or RX_FECHA_NUM.search(s)
     if not m:
         return raw.strip()
@@ -144,11 +194,20 @@ def normalize_fecha(raw: str) -> str:
         mm_txt = meses[mm_i] if 0 < mm_i < len(meses) else str(mm_i)
         return f"{dd:02d}/{mm_txt}/{yy[-2:]}" if yy else f"{dd:02d}/{mm_txt}"
 
+_normalize_fecha_cached = lru_cache(maxsize=8192)(_normalize_fecha)
+
+def normalize_fecha(raw: str) -> str:
+    return _normalize_fecha_cached(raw) if len(raw) <= CACHE_MAX_LEN else _normalize_fecha(raw)
+
 def parse_amount_to_float(s):
     if s is None: return np.nan
-    m = EXTRACT_AMOUNT_RE.search(str(s))
+    ss = str(s).strip()
+    if not ss: return np.nan
+    if _FAST_AMOUNT.fullmatch(ss):
+        return float(ss.replace(',', ''))
+    m = EXTRACT_AMOUNT_RE.search(ss)
     if not m:
-        digits = ''.join(ch for ch in str(s) if ch.isdigit())
+        digits = only_digits(ss)
         return float(digits) if digits else np.nan
     token = m.group(1)
     last_dot, last_comma = token.rfind('.'), token.rfind(',')
@@ -161,24 +220,34 @@ def parse_amount_to_float(s):
     except Exception:
         return np.nan
 
-def group_tokens_by_y(tokens, y_tol=ROW_Y_TOL):
-    items = [(y_center(bb), min(p[0] for p in bb), bb, txt) for bb, txt in tokens]
-    items.sort(key=lambda z: z[0])
-    lines, cur, last_y = [], [], None
-    for yc, xl, bb, txt in items:
-        if last_y is None or abs(yc - last_y) <= y_tol:
-            cur.append((xl, bb, txt, yc))
-        else:
-            lines.append(cur); cur = [(xl, bb, txt, yc)]
-        last_y = yc
-    if cur: lines.append(cur)
+def token_arrays(results):
+    """Tokens OCR como arreglos paralelos (SoA): x centro, y centro, x izquierda y textos."""
+    n = len(results)
+    pts = np.array([bb for (bb, _t, _p) in results], dtype=np.float64).reshape(n, 4, 2)
+    xc = (pts[:, 0, 0] + pts[:, 2, 0]) / 2.0
+    yc = ((pts[:, 0, 1] + pts[:, 2, 1]) / 2).astype(np.int64)
+    xl = pts[:, :, 0].min(axis=1)
+    texts = np.array([str(t) for (_bb, t, _p) in results], dtype=object)
+    return xc, yc, xl, texts
+
+def group_tokens_by_y(idx, yc, xl, texts, y_tol=ROW_Y_TOL, presorted: bool = False):
+    """Agrupa en líneas los tokens `idx` (índices sobre los arreglos SoA).
+    Con presorted=True `idx` ya viene ordenado (estable) por Y y no se reordena.
+    Devuelve [(y_mediana, texto unido de izquierda a derecha, índices de la línea)]."""
+    if not len(idx):
+        return []
+    if not presorted:
+        idx = idx[np.argsort(yc[idx], kind="stable")]
+    ys = yc[idx]
+    # corte donde el salto entre Y consecutivas supera la tolerancia
+    cuts = np.flatnonzero(np.abs(np.diff(ys)) > y_tol) + 1
     out = []
-    for line in lines:
-        line.sort(key=lambda z: z[0])
-        yc = int(median([z[3] for z in line]))
-        txt = " ".join(z[2] for z in line)
-        bbs = [z[1] for z in line]
-        out.append((yc, txt, bbs))
+    for line, line_ys in zip(np.split(idx, cuts), np.split(ys, cuts)):
+        # la línea viene ordenada por Y: la mediana es el (los) elemento(s) central(es)
+        n = len(line)
+        y_med = int((line_ys[(n - 1) // 2] + line_ys[n // 2]) / 2)
+        line = line[np.argsort(xl[line], kind="stable")]
+        out.append((y_med, " ".join(texts[line]), line))
     return out
 
 def bbox_union(bboxes):
@@ -187,64 +256,128 @@ def bbox_union(bboxes):
     return [(min(xs), min(ys)), (max(xs), min(ys)), (max(xs), max(ys)), (min(xs), max(ys))]
 
 # -------- Detectar líneas horizontales y bandas de filas --------
-def detect_row_bands(img_crop):
-    """Devuelve (bands, mask, y_lines) usando líneas horizontales.
-       Parámetros RELAJADOS para no perdernos filas."""
+def _merge_and_band(ys, height):
+    """Con las Y de las reglas (ordenadas): fusiona las que distan <= 8 px y arma las
+    bandas (y0, y1) de >= 14 px entre ellas. Devuelve (centros, bandas Nx2)."""
+    merged = np.empty(ys.shape[0], dtype=np.int64)
+    n = 0
+    c0 = ys[0]
+    c1 = ys[0]
+    for i in range(1, ys.shape[0]):
+        v = ys[i]
+        if v - c1 <= 8:
+            c1 = v
+        else:
+            merged[n] = (c0 + c1) // 2
+            n += 1
+            c0 = v
+            c1 = v
+    merged[n] = (c0 + c1) // 2
+    n += 1
+
+    # banda superior desde inicio del recorte hasta primera línea (para cabecera/primera fila)
+    bands = np.empty((n + 1, 2), dtype=np.int64)
+    nb = 0
+    prev = 0
+    for k in range(n):
+        y = merged[k]
+        if y - prev >= 14:
+            bands[nb, 0] = prev
+            bands[nb, 1] = y - 1
+            nb += 1
+        prev = y + 1
+    # banda final
+    if height - prev >= 14:
+        bands[nb, 0] = prev
+        bands[nb, 1] = height - 1
+        nb += 1
+    return merged[:n], bands[:nb]
+
+def _group_sorted(ys, tol):
+    """Índice de inicio de cada grupo en ys ordenadas (corte cuando el salto es >= tol)."""
+    starts = np.empty(ys.shape[0], dtype=np.int64)
+    starts[0] = 0
+    n = 1
+    for i in range(1, ys.shape[0]):
+        if ys[i] - ys[i - 1] >= tol:
+            starts[n] = i
+            n += 1
+    return starts[:n]
+
+if NUMBA_AVAILABLE:
+    _merge_and_band = njit(cache=True)(_merge_and_band)
+    _group_sorted = njit(cache=True)(_group_sorted)
+
+def _row_lines_skew_tolerant(img_crop):
+    """Y de las reglas horizontales (y su máscara) con apertura morfológica + contornos y,
+    si no hay ninguna, HoughLinesP. Más lento que la proyección por filas, pero no exige que
+    la regla caiga en una sola fila de píxeles."""
     gray = cv2.cvtColor(img_crop, cv2.COLOR_BGR2GRAY)
-    # binarizar más sensible
     bw = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                cv2.THRESH_BINARY_INV, 31, 9)
     h, w = bw.shape
-    # kernel horizontal (más corto que antes)
     klen = max(25, w // 10)
     h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (klen, 1))
     horiz = cv2.morphologyEx(bw, cv2.MORPH_OPEN, h_kernel, iterations=1)
-    # consolidar
-    horiz = cv2.dilate(horiz, np.ones((1,3), np.uint8), iterations=1)
+    horiz = cv2.dilate(horiz, np.ones((1, 3), np.uint8), iterations=1)
 
     cnts, _ = cv2.findContours(horiz, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     ys = []
     for c in cnts:
         x, y, ww, hh = cv2.boundingRect(c)
-        # más permisivo en ancho, aún exige buena longitud
         if ww >= int(0.45 * w) and 1 <= hh <= 10:
             ys.append(int(y + hh/2))
-    # fallback Hough si nada
     if not ys:
         lines = cv2.HoughLinesP(horiz, 1, np.pi/180, threshold=100,
                                 minLineLength=int(0.45*w), maxLineGap=10)
         if lines is not None:
             for l in lines:
-                x1,y1,x2,y2 = l[0]
+                x1, y1, x2, y2 = l[0]
                 if abs(y1-y2) <= 3:
                     ys.append(int((y1+y2)//2))
+    return ys, horiz
+
+def detect_row_bands(img_crop):
+    """Devuelve (bands, mask, y_lines) usando líneas horizontales.
+       Parámetros RELAJADOS para no perdernos filas."""
+    src = cv2.UMat(img_crop) if _opencl_available() else img_crop
+    gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+    # binarizar (bloque chico: sólo buscamos filas con mucha tinta)
+    bw = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                               cv2.THRESH_BINARY_INV, 15, 9)
+    h, w = img_crop.shape[:2]
+    # proyección horizontal: una regla ocupa >= 45% del ancho en su fila
+    # (sólo este vector de h enteros vuelve de la GPU)
+    row_sum = cv2.reduce(bw, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S)
+    if isinstance(row_sum, cv2.UMat):
+        row_sum = row_sum.get()
+    peaks = np.flatnonzero(row_sum.ravel() > int(0.45 * w) * 255)
+    horiz = np.zeros((h, w), dtype=np.uint8)
+    horiz[peaks] = 255
+
+    ys = []
+    if len(peaks):
+        # filas consecutivas = una misma línea; exige grosor 1..10 px
+        cuts = np.flatnonzero(np.diff(peaks) > 1) + 1
+        starts = peaks[np.r_[0, cuts]]
+        ends = peaks[np.r_[cuts - 1, len(peaks) - 1]]
+        thin = (ends - starts + 1) <= 10
+        ys = ((starts[thin] + ends[thin]) // 2).tolist()
+
+    # en una página escaneada con inclinación la proyección pierde las reglas que suben o
+    # bajan (todas o sólo algunas, y las que ve pueden quedar a intervalos regulares): se
+    # corre también el camino original, que las tolera, y se queda el que encuentre más
+    ys_alt, horiz_alt = _row_lines_skew_tolerant(img_crop)
+    if len(ys_alt) > len(ys):
+        ys, horiz = ys_alt, horiz_alt
 
     if not ys:
         return [], horiz, []
 
-    ys = sorted(ys)
-    # merge líneas cercanas
-    merged = []
-    cur = [ys[0], ys[0]]
-    for v in ys[1:]:
-        if v - cur[1] <= 8:
-            cur[1] = v
-        else:
-            merged.append(int((cur[0]+cur[1])//2))
-            cur = [v, v]
-    merged.append(int((cur[0]+cur[1])//2))
-
-    # construir bandas entre líneas
-    bands = []
-    # banda superior desde inicio del recorte hasta primera línea (para cabecera/primera fila)
-    prev = 0
-    for y in merged:
-        if y - prev >= 14:
-            bands.append((prev, y-1))
-        prev = y+1
-    # banda final
-    if img_crop.shape[0]-prev >= 14:
-        bands.append((prev, img_crop.shape[0]-1))
+    # los contornos salen de abajo hacia arriba: _merge_and_band espera las Y ordenadas
+    merged, bands = _merge_and_band(np.sort(np.array(ys, dtype=np.int64)), img_crop.shape[0])
+    merged = merged.tolist()
+    bands = [(int(y0), int(y1)) for y0, y1 in bands]
 
     # filtra bandas muy altas (encabezado) si no hay montos
     return bands, horiz, merged
@@ -252,11 +385,12 @@ def detect_row_bands(img_crop):
 # =========================
 # PREVIEW
 # =========================
-def draw_preview(img_crop, results, col_ranges, page_num=1, text_limit=40, headers_info=None, lines_img=None, ylines=None, bands=None):
+def draw_preview(img_crop, results, col_ranges, page_num=1, text_limit=40, headers_info=None, lines_img=None, ylines=None, bands=None, copy: bool = True):
+    # copy=False dibuja sobre img_crop (para quien ya no la va a reutilizar)
     if not MATPLOTLIB_AVAILABLE:
         print("⚠️ matplotlib no disponible, omitiendo preview visual")
         return
-    vis = img_crop.copy()
+    vis = img_crop.copy() if copy else img_crop
     h, w = vis.shape[:2]
     # Bandas columnas
     for k,(xs,xe) in col_ranges.items():
@@ -286,8 +420,9 @@ def draw_preview(img_crop, results, col_ranges, page_num=1, text_limit=40, heade
                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLORS["HEADER"], 2)
     # Líneas horizontales + bandas
     if lines_img is not None:
-        mask_rgb = cv2.cvtColor(lines_img, cv2.COLOR_GRAY2BGR)
-        mask_rgb = (mask_rgb>0).astype(np.uint8)*np.array(COLORS["LINE"],dtype=np.uint8)
+        # color LINE donde hay línea: min(máscara 0/255, canal) por canal, sin temporales BGR
+        mask = cv2.compare(lines_img, 0, cv2.CMP_GT)
+        mask_rgb = cv2.merge([cv2.min(mask, float(c)) for c in COLORS["LINE"]])
         vis = cv2.addWeighted(vis, 1.0, mask_rgb, 0.35, 0)
     if ylines:
         for y in ylines:
@@ -308,9 +443,16 @@ def draw_preview(img_crop, results, col_ranges, page_num=1, text_limit=40, heade
 # =========================
 # EXTRACCIÓN con líneas de fila + fallback
 # =========================
-def extract_page(img_bgr, page_num, col_ranges, reader, save_debug_dir=None):
-    img_crop = img_bgr[TOP_CROP: img_bgr.shape[0]-BOTTOM_CROP, :]
-    results = reader.readtext(img_crop, detail=1, paragraph=False)
+def crop_page(img_bgr):
+    return img_bgr[TOP_CROP: img_bgr.shape[0]-BOTTOM_CROP, :]
+
+# Columnas de las filas crudas (extract_page_rows) y del DataFrame final
+ROW_COLS = ["PAGINA", "FECHA", "DESCRIPCION", "DEPOSITO", "RETIRO", "SALDO"]
+OUT_COLS = ROW_COLS[1:]
+
+def extract_page_rows(img_crop, results, page_num, col_ranges, save_debug_dir=None):
+    """Filas crudas (PAGINA, FECHA, DESCRIPCION, DEPOSITO, RETIRO, SALDO) de una página ya
+    recortada (crop_page) y su OCR; montos aún como texto. La limpieza va en rows_to_frame."""
 
     # Gate por cabeceras EN MAYÚSCULAS
     found, header_matches = detect_headers_uppercase(results)
@@ -318,86 +460,92 @@ def extract_page(img_bgr, page_num, col_ranges, reader, save_debug_dir=None):
         if save_debug_dir:
             save_debug_dir.mkdir(parents=True, exist_ok=True)
             cv2.imwrite(str(save_debug_dir / f"p{page_num:03d}_IGNORED_crop.png"), img_crop)
-        return pd.DataFrame(columns=["FECHA","DESCRIPCION","DEPOSITO","RETIRO","SALDO"])
+        return []
 
     # Detectar líneas horizontales -> bandas
     bands, lines_img, ylines = detect_row_bands(img_crop)
     # Si detectó muy pocas bandas, haremos fallback por proyección
     use_fallback = len(bands) <= 5
 
-    # Tokens por columna
-    tok = {k: [] for k in col_ranges.keys()}
-    for (bb, txt, _p) in results:
-        for col,(xs,xe) in col_ranges.items():
-            if in_band_center(bb, xs, xe):
-                tok[col].append((bb, txt))
-                break
+    # Tokens como arreglos paralelos; por columna, sus índices ordenados (estable) por Y
+    tok_xc, tok_yc, tok_xl, texts = token_arrays(results)
+    tok, tok_ys = {}, {}
+    libre = np.ones(len(results), dtype=bool)
+    for col, (xs, xe) in col_ranges.items():
+        m = libre & (xs <= tok_xc) & (tok_xc < xe)
+        idx = np.flatnonzero(m)
+        tok[col] = idx[np.argsort(tok_yc[idx], kind="stable")]
+        tok_ys[col] = tok_yc[tok[col]]
+        libre &= ~m
 
     # Helper: agrupar por Y (fallback)
     def amount_rows_by_projection():
-        amount_tokens = []
+        amount_ys = []
         for col in ("DEPOSITO","RETIRO","SALDO"):
-            for (bb, txt) in tok.get(col, []):
-                if MONTOS_RX.match(str(txt).replace(" ", "")):
-                    amount_tokens.append({"y": y_center(bb), "col": col, "text": txt.strip(), "bbox": bb})
-        if not amount_tokens:
+            for i in tok.get(col, ()):
+                if MONTOS_RX.match(texts[i].replace(" ", "")):
+                    amount_ys.append(tok_yc[i])
+        if not amount_ys:
             return []
 
-        row_groups, current, last_y = [], [], None
-        for d in sorted(amount_tokens, key=lambda r: r["y"]):
-            if last_y is None or abs(d["y"] - last_y) < 15:
-                current.append(d)
-            else:
-                row_groups.append(current); current = [d]
-            last_y = d["y"]
-        if current: row_groups.append(current)
+        # filas = tramos de Y ordenadas con saltos < 15 px
+        ys = np.sort(np.array(amount_ys, dtype=np.int64))
+        starts = _group_sorted(ys, 15)
+        ends = np.append(starts[1:], len(ys))
+
+        # mediana exacta de cada tramo (ya ordenado)
+        n = ends - starts
+        medians = ((ys[starts + (n - 1) // 2] + ys[starts + n // 2]) / 2).astype(np.int64)
 
         bands_fallback = []
-        for g in row_groups:
-            ys = [it["y"] for it in g]
-            yc = int(median(ys))
-            y0 = yc - 12
-            y1 = yc + 12
+        for ym in medians.tolist():
+            y0 = ym - 12
+            y1 = ym + 12
             bands_fallback.append((max(0,y0), min(img_crop.shape[0]-1,y1)))
         return bands_fallback
 
     if use_fallback:
         bands = amount_rows_by_projection()
 
-    # Función para tokens dentro de una banda
-    def tokens_in_band(pairs, y0, y1):
-        return [(bb,txt) for (bb,txt) in pairs if y0 <= y_center(bb) <= y1]
+    # Índices de los tokens de una columna con y0 <= Y <= y1 (tramo contiguo, ordenado por Y)
+    sin_tokens = np.empty(0, dtype=np.int64)
+    def tokens_in_band(col, y0, y1):
+        if col not in tok:
+            return sin_tokens
+        ys = tok_ys[col]
+        return tok[col][np.searchsorted(ys, y0, "left"):np.searchsorted(ys, y1, "right")]
 
     rows = []
     for (y0, y1) in bands:
         # FECHA (sólo “fecha-like”)
-        f_tokens = tokens_in_band(tok.get("FECHA", []), y0, y1)
-        f_lines = group_tokens_by_y(f_tokens, y_tol=ROW_Y_TOL)
+        f_tokens = tokens_in_band("FECHA", y0, y1)
+        f_lines = group_tokens_by_y(f_tokens, tok_yc, tok_xl, texts, y_tol=ROW_Y_TOL, presorted=True)
         fecha_pick = ""
         if f_lines:
             # candidatas que parezcan fecha
             cand = []
-            for (yc, t, bbs) in f_lines:
+            for (yc, t, line) in f_lines:
                 norm = normalize_text(t)
                 if RX_FECHA_MES.search(norm) or RX_FECHA_NUM.search(norm):
-                    cand.append((yc, t.strip(), bbs))
+                    cand.append((yc, t.strip(), line))
             if cand:
                 j = min(range(len(cand)), key=lambda i: abs(cand[i][0]-y0))
                 fecha_pick = normalize_fecha(cand[j][1])
 
         # DESCRIP (primera línea en banda)
-        d_tokens = tokens_in_band(tok.get("DESCRIP", []), y0, y1)
-        d_lines = group_tokens_by_y(d_tokens, y_tol=ROW_Y_TOL)
-        d_lines.sort(key=lambda t:t[0])
+        d_tokens = tokens_in_band("DESCRIP", y0, y1)
+        # las líneas ya salen en orden de Y
+        d_lines = group_tokens_by_y(d_tokens, tok_yc, tok_xl, texts, y_tol=ROW_Y_TOL, presorted=True)
         descr_pick = d_lines[0][1].strip() if d_lines else ""
 
         # Montos
         def pick_amount(colname):
-            a_tokens = tokens_in_band(tok.get(colname, []), y0, y1)
-            a_tokens = [(bb,txt) for (bb,txt) in a_tokens if MONTOS_RX.match(str(txt).replace(" ",""))]
-            if not a_tokens:
+            a_idx = [i for i in tokens_in_band(colname, y0, y1).tolist()
+                     if MONTOS_RX.match(texts[i].replace(" ",""))]
+            if not a_idx:
                 return ""
-            return max(a_tokens, key=lambda it: len(str(it[1])))[1].strip()
+            # el más largo; en empate, el primero que entregó el OCR
+            return texts[max(a_idx, key=lambda i: (len(texts[i]), -i))].strip()
 
         dep = pick_amount("DEPOSITO")
         ret = pick_amount("RETIRO")
@@ -406,92 +554,105 @@ def extract_page(img_bgr, page_num, col_ranges, reader, save_debug_dir=None):
         if not any([fecha_pick, descr_pick, dep, ret, sal]):
             continue
 
-        rows.append({"FECHA": fecha_pick, "DESCRIPCION": descr_pick,
-                     "DEPOSITO": dep, "RETIRO": ret, "SALDO": sal})
+        rows.append((page_num, fecha_pick, descr_pick, dep, ret, sal))
+
+    # Guardar overlays sólo en modo debug (junto a los IGNORED de la misma corrida)
+    if save_debug_dir is not None and not PREVIEW_ONLY:
+        save_debug_dir.mkdir(parents=True, exist_ok=True)
+        ov = img_crop.copy()
+        h, w = ov.shape[:2]
+        for k,(xs,xe) in col_ranges.items():
+            cv2.rectangle(ov, (int(xs),0), (int(xe),h), COLORS.get(k,(120,120,120)), 2)
+        # si veníamos del detector de líneas
+        if ylines:
+            for y in ylines:
+                cv2.line(ov, (0,y), (w,y), COLORS["LINE"], 1)
+        for (y0,y1) in bands:
+            cv2.rectangle(ov, (0,y0), (w,y1), COLORS["BAND"], 1)
+        cv2.imwrite(str(save_debug_dir / f"p{page_num:03d}_overlay.png"), ov)
 
+    return rows
+
+def rows_to_frame(rows):
+    """Arma el DataFrame (OUT_COLS) de las filas crudas de una o varias páginas, de una vez:
+    montos a float, ffill de FECHA/DESCRIP por página y limpieza de movimientos."""
     if not rows:
-        return pd.DataFrame(columns=["FECHA","DESCRIPCION","DEPOSITO","RETIRO","SALDO"])
+        return pd.DataFrame(columns=OUT_COLS)
 
-    df = pd.DataFrame(rows, columns=["FECHA","DESCRIPCION","DEPOSITO","RETIRO","SALDO"])
-    for c in ["DEPOSITO","RETIRO","SALDO"]:
-        df[c] = df[c].apply(parse_amount_to_float)
+    df = pd.DataFrame.from_records(rows, columns=ROW_COLS)
+    for c in ("DEPOSITO", "RETIRO", "SALDO"):
+        df[c] = np.array([parse_amount_to_float(v) for v in df[c].tolist()], dtype=np.float64)
 
-    # Forward-fill de FECHA/DESCRIP si hay montos (misma operación/concepto)
+    # Forward-fill de FECHA/DESCRIP si hay montos (misma operación/concepto), sin cruzar páginas
     mask_has_amount = df[["DEPOSITO","RETIRO","SALDO"]].notna().any(axis=1)
     df.loc[mask_has_amount, ["FECHA","DESCRIPCION"]] = (
         df.loc[mask_has_amount, ["FECHA","DESCRIPCION"]]
           .replace(r'^\s*$', np.nan, regex=True)
+          .groupby(df.loc[mask_has_amount, "PAGINA"])
           .ffill()
     )
 
     # Limpieza puntual solicitada:
-    # 1) Quitar fechas tipo "15-ENE-23" de DESCRIPCION y usarlas como FECHA si falta
+    # 1) Quitar fechas tipo "15-ENE-23" de DESCRIPCION y usarlas como FECHA
+    desc = df["DESCRIPCION"]
+    fecha_desc = desc.str.extract(f"({RX_FECHA_DMY_IN_DESC.pattern})", flags=re.I, expand=True)[0]
+    con_fecha = fecha_desc.notna()
+    if con_fecha.any():
+        # siempre usar la fecha detectada en la descripción y quitar TODAS sus ocurrencias
+        df.loc[con_fecha, "FECHA"] = fecha_desc[con_fecha].map(normalize_fecha)
+        df.loc[con_fecha, "DESCRIPCION"] = (
+            desc[con_fecha]
+            .str.replace(RX_FECHA_DMY_IN_DESC, " ", regex=True)
+            .str.replace(r"\s+", " ", regex=True)
+            .str.strip(" -,:;")
+        )
+
     # 2) Asegurar que cada movimiento tenga solo DEPOSITO o RETIRO (no ambos)
-    def _clean_row(row):
-        desc = row.get("DESCRIPCION", "")
-        if isinstance(desc, str) and desc:
-            m = RX_FECHA_DMY_IN_DESC.search(desc)
-            if m:
-                # siempre usar la fecha detectada en la descripción
-                try:
-                    fecha_norm = normalize_fecha(m.group(0))
-                    row["FECHA"] = fecha_norm
-                except Exception:
-                    pass
-                # quitar TODAS las ocurrencias del token de fecha en la descripción
-                desc = RX_FECHA_DMY_IN_DESC.sub(" ", desc)
-                desc = re.sub(r"\s+", " ", desc).strip(" -,:;")
-                row["DESCRIPCION"] = desc
-
-        dep = row.get("DEPOSITO", np.nan)
-        ret = row.get("RETIRO", np.nan)
-        if pd.notna(dep) and pd.notna(ret):
-            # Heurística simple por palabras clave en descripción
-            descr_norm = normalize_text(row.get("DESCRIPCION", ""))
-            retiro_words = ("CARGO","RETIRO","COMISION","COMISIÓN","IVA","ENVIO","ENVÍO","PAGO","TRANSFERENCIA")
-            deposito_words = ("ABONO","DEPOSITO","DEPÓSITO","RECIBIDO","TRASPASO","DEVOLUCION","DEVOLUCIÓN","SPEI RECIBIDO")
-            if any(w in descr_norm for w in retiro_words):
-                row["DEPOSITO"] = np.nan
-            elif any(w in descr_norm for w in deposito_words):
-                row["RETIRO"] = np.nan
-            else:
-                # Si no hay pista, conservar solo el mayor
-                try:
-                    if float(dep) >= float(ret):
-                        row["RETIRO"] = np.nan
-                    else:
-                        row["DEPOSITO"] = np.nan
-                except Exception:
-                    # fallback: preferir mantener un solo campo (retiro)
-                    row["DEPOSITO"] = np.nan
-        return row
-
-    df = df.apply(_clean_row, axis=1)
+    dep, ret = df["DEPOSITO"], df["RETIRO"]
+    both = dep.notna() & ret.notna()
+    if both.any():
+        # Heurística simple por palabras clave; sin pista, conservar solo el mayor
+        descr_norm = df.loc[both, "DESCRIPCION"].fillna("").map(normalize_text)
+        es_retiro = descr_norm.str.contains(RETIRO_KEYWORDS_RX, regex=True)
+        es_deposito = ~es_retiro & descr_norm.str.contains(DEPOSITO_KEYWORDS_RX, regex=True)
+        sin_pista = ~es_retiro & ~es_deposito
+        dep_mayor = dep[both] >= ret[both]
+        quita_dep = es_retiro | (sin_pista & ~dep_mayor)
+        quita_ret = es_deposito | (sin_pista & dep_mayor)
+        df.loc[quita_dep[quita_dep].index, "DEPOSITO"] = np.nan
+        df.loc[quita_ret[quita_ret].index, "RETIRO"] = np.nan
 
     # Mantener solo movimientos con exactamente un monto en DEPOSITO o RETIRO
     # Excepción: "SALDO ANTERIOR" se mantiene aunque solo tenga SALDO
     mask_exactly_one = df["DEPOSITO"].notna() ^ df["RETIRO"].notna()
     mask_saldo_anterior = df["DESCRIPCION"].str.contains("SALDO ANTERIOR", case=False, na=False) & df["SALDO"].notna()
-    df = df[mask_exactly_one | mask_saldo_anterior].reset_index(drop=True)
+    return df.loc[mask_exactly_one | mask_saldo_anterior, OUT_COLS].reset_index(drop=True)
 
-    # Guardar overlays si aplica
-    if not PREVIEW_ONLY:
-        base = Path.cwd()
-        dbg_dir = base / "salidas" / "debug_banorte_lines"
-        dbg_dir.mkdir(parents=True, exist_ok=True)
-        ov = img_crop.copy()
-        h, w = ov.shape[:2]
-        for k,(xs,xe) in col_ranges.items():
-            cv2.rectangle(ov, (int(xs),0), (int(xe),h), COLORS.get(k,(120,120,120)), 2)
-        # si veníamos del detector de líneas
-        if ylines:
-            for y in ylines:
-                cv2.line(ov, (0,y), (w,y), COLORS["LINE"], 1)
-        for (y0,y1) in bands:
-            cv2.rectangle(ov, (0,y0), (w,y1), COLORS["BAND"], 1)
-        cv2.imwrite(str(dbg_dir / f"p{page_num:03d}_overlay.png"), ov)
+def extract_page(img_crop, results, page_num, col_ranges, save_debug_dir=None):
+    """Movimientos de una sola página como DataFrame (OUT_COLS)."""
+    return rows_to_frame(extract_page_rows(img_crop, results, page_num, col_ranges,
+                                           save_debug_dir=save_debug_dir))
 
-    return df.reset_index(drop=True)
+# =========================
+# OCR en paralelo por bloques de páginas
+# =========================
+def _ocr_extract_chunk(first_page, crops, col_ranges, save_debug_dir):
+    """OCR en lote + filas crudas de un bloque contiguo de páginas."""
+    # una escala por página según su altura de línea; cada página va completa al OCR y el gate
+    # de cabeceras se aplica en extract_page_rows
+    scales = [ocr_scale(c, target_line_h=OCR_TARGET_LINE_H, min_scale=OCR_MIN_SCALE) for c in crops]
+    results_list = ocr_pages_batched(crops, get_reader(), scales=scales)
+    rows = []
+    for k, (crop, results) in enumerate(zip(crops, results_list)):
+        rows.extend(extract_page_rows(crop, results, first_page + k, col_ranges,
+                                      save_debug_dir=save_debug_dir))
+    return rows
+
+def ocr_extract_pages(crops, col_ranges, save_debug_dir=None, workers: Optional[int] = None):
+    """Devuelve las filas crudas (ROW_COLS) de todas las páginas, en orden.
+    Con varios workers reparte bloques contiguos de páginas entre procesos."""
+    return map_page_chunks(_ocr_extract_chunk, crops, col_ranges, save_debug_dir,
+                           workers=workers or OCR_WORKERS)
 
 # =========================
 # MAIN
@@ -502,7 +663,6 @@ def process_banorte_pdf(pdf_path_in: str, save_debug: bool = True) -> dict:
     """
     try:
         pages = pdf_to_images_bgr(pdf_path_in, zoom=ZOOM)
-        reader = easyocr.Reader(['es'], gpu=False)
 
         base_dir = Path(__file__).parent
         pdf_stem = Path(pdf_path_in).stem
@@ -511,17 +671,11 @@ def process_banorte_pdf(pdf_path_in: str, save_debug: bool = True) -> dict:
         if save_debug:
             debug_dir.mkdir(parents=True, exist_ok=True)
 
-        dfs = []
-        for idx, img_bgr in enumerate(pages, start=1):
-            dfp = extract_page(img_bgr, idx, MANUAL_COL_RANGES, reader,
-                               save_debug_dir=(debug_dir if save_debug else None))
-            if not dfp.empty:
-                dfs.append(dfp)
-
-        if dfs:
-            df_final = pd.concat(dfs, ignore_index=True)
-        else:
-            df_final = pd.DataFrame(columns=["FECHA","DESCRIPCION","DEPOSITO","RETIRO","SALDO"])
+        # OCR en lote (repartido entre procesos) + filas de todas las páginas; un solo DataFrame
+        crops = [crop_page(img) for img in pages]
+        rows = ocr_extract_pages(crops, MANUAL_COL_RANGES,
+                                 save_debug_dir=(debug_dir if save_debug else None))
+        df_final = rows_to_frame(rows)
 
         movimientos = []
         for _, row in df_final.iterrows():
@@ -1,17 +1,39 @@
 from __future__ import annotations
+import os
 import cv2
-import easyocr
+import hashlib
+import math
 import re
+import shutil
+import time
 import pandas as pd
 import numpy as np
 import fitz  # PyMuPDF
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+from app.utils.ocr_common import (OCR_WORKERS, SOLO_DIGITOS, TablaFiltro, get_reader,
+                                   map_page_chunks, ocr_pages_batched, only_digits)
+
 # =========================
 # CONFIG
 # =========================
 ZOOM = 2.5
 SAVE_DEBUG = False                    # guardar PNGs de diagnóstico
+_BASE_DIR = Path(__file__).resolve().parent   # salidas/<pdf>/ de debug cuelgan de aquí
+PAGES_CACHE = False                   # memoriza en disco las páginas renderizadas (mismo PDF => sin rasterizar)
+PAGES_CACHE_MAX_AGE_S = 7 * 24 * 3600 # entradas sin uso por más de esto se borran
+PAGES_CACHE_MAX_BYTES = 2 * 1024**3   # tope del caché completo; se borran primero las menos usadas
+
+# Recorte vertical (quita encabezado/pie) antes del OCR
+TOP_CROP = 90
+BOTTOM_CROP = 60
 
 # Rangos X (en píxeles) dentro del RECORTE VERTICAL (img_crop)
 COLUMNAS = {"CARGOS": (880, 1000), "ABONOS": (1030, 1170), "LIQUIDACI": (1350, 1500)}
@@ -23,11 +45,22 @@ ROW_Y_TOL = 16  # tolerancia vertical
 
 # Patrones
 MONTOS = re.compile(r'^\d{1,3}(?:[ ,]?\d{3})*(?:\.\d{2})$')
+# Forma habitual de los montos ("1,234.56" / "1234.56"): se convierte sin EXTRACT_AMOUNT_RE
+_FAST_AMOUNT = re.compile(r'[0-9]{1,3}(?:,[0-9]{3})*\.[0-9]{2}|[0-9]+\.[0-9]{2}')
 EXTRACT_AMOUNT_RE = re.compile(r'(?<!\d)(\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2}))(?!\d)')
 # Acepta: ref / referencia; con ., :, -, espacios; máscaras; concatena dígitos
 REF_BLOCK_RX = re.compile(r'(?i)\bref(?:erencia)?\b\.?\s*[:\-]?\s*(.+)$')
 # Ruido a eliminar solo en CONCEPTO (fantasmas de fecha)
 NOISE_CONCEPTO_RX = re.compile(r'\b(?:OSIMAY|O6IMAY)\b', re.I)
+# Patrones de uso puntual en los bucles por línea/fila (compilados una vez)
+RX_WS = re.compile(r'\s+')
+RX_WS_MULTI = re.compile(r'\s{2,}')
+RX_REF_WORD = re.compile(r'\bref', re.I)
+RX_HAS_DIGIT = re.compile(r'\d')
+RX_REF_VALIDA = re.compile(r'\d{2,}')
+RX_O_TRAS_DIGITO = re.compile(r'(?<=\d)O')
+RX_O_ANTES_DIGITO = re.compile(r'O(?=\d)')
+RX_AAZ = re.compile(r'\bAAZ\b', re.I)
 
 COLOR_BAND = {
     "CARGOS": (0, 0, 255), "ABONOS": (255, 255, 0), "LIQUIDACI": (255, 0, 255),
@@ -46,24 +79,98 @@ def pdf_to_images_bgr(path: str, zoom: float = 2.0) -> list:
     imgs = []
     for page in doc:
         pm = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
-        arr = np.frombuffer(pm.samples, dtype=np.uint8).reshape(pm.h, pm.w, pm.n)
+        # Vista sin copia sobre el buffer del pixmap (válida mientras viva pm); cvtColor hace
+        # la única copia (ya en BGR) antes de soltar el pixmap
+        arr = np.frombuffer(pm.samples_mv, dtype=np.uint8).reshape(pm.h, pm.w, pm.n)
         if pm.n == 3:
             bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
         elif pm.n == 1:
             bgr = cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
         else:
-            bgr = cv2.cvtColor(arr[:, :, :3], cv2.COLOR_RGB2BGR)
+            bgr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
         imgs.append(bgr)
+        pm = arr = None  # libera el pixmap antes de renderizar la siguiente página
     doc.close()
     return imgs
 
-reader = easyocr.Reader(['es'], gpu=False)
+def _save_atomic(dest: Path, write) -> None:
+    """Escribe con write(archivo) en un temporal junto a `dest` y lo mueve con os.replace:
+    un lector concurrente ve el archivo completo o no lo ve."""
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as fh:
+        write(fh)
+    os.replace(tmp, dest)
+
+def _evict_pages_cache(keep: Path) -> None:
+    """Borra las entradas de salidas/*/pages/<clave> sin uso en PAGES_CACHE_MAX_AGE_S y, si el
+    resto pasa de PAGES_CACHE_MAX_BYTES, las de uso más antiguo (mtime del `.completo`, que se
+    renueva en cada acierto). `keep` (la recién escrita) no se toca. Es de mejor esfuerzo: lo
+    que otro proceso borre a la vez se omite al medir."""
+    now = time.time()
+    entries = []
+    for d in (_BASE_DIR / "salidas").glob("*/pages/*"):
+        if d == keep or not d.is_dir():
+            continue
+        marker = d / ".completo"
+        try:
+            used = (marker if marker.exists() else d).stat().st_mtime
+            size = sum(f.stat().st_size for f in d.iterdir())
+        except OSError:
+            continue
+        entries.append((used, size, d))
+    try:
+        total = sum(f.stat().st_size for f in keep.iterdir())
+    except OSError:
+        total = 0
+    for used, size, d in sorted(entries, reverse=True):   # más reciente primero
+        if now - used > PAGES_CACHE_MAX_AGE_S or total + size > PAGES_CACHE_MAX_BYTES:
+            shutil.rmtree(d, ignore_errors=True)
+        else:
+            total += size
+
+def pdf_to_images_cached(path: str, zoom: float = 2.0) -> list:
+    """pdf_to_images_bgr memorizado en salidas/<pdf>/pages/<clave>/pNNN.npy (sin comprimir:
+    leerlo cuesta menos que decodificar un PNG o volver a rasterizar).
+    La clave sale de la ruta absoluta, tamaño, mtime y zoom: si el PDF cambia, se vuelve a
+    rasterizar, y dos PDFs con el mismo nombre en carpetas distintas no comparten entrada.
+    Cada archivo se escribe en un temporal y se mueve con os.replace; el `.completo` va al
+    final, así que sin él el caché no se usa. Al escribir una entrada se aplican los límites
+    de edad y tamaño (_evict_pages_cache)."""
+    st = os.stat(path)
+    key = hashlib.blake2b(f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}:{zoom}".encode(),
+                          digest_size=8).hexdigest()
+    cache_dir = _BASE_DIR / "salidas" / Path(path).stem / "pages" / key
+    marker = cache_dir / ".completo"
+    if marker.exists():
+        try:
+            n = int(marker.read_text())
+            imgs = [np.load(cache_dir / f"p{i:03d}.npy") for i in range(1, n + 1)]
+            os.utime(marker)   # último uso, para el desalojo
+            return imgs
+        except (OSError, ValueError):
+            pass   # entrada desalojada o dañada a medio leer: se vuelve a rasterizar
+    imgs = pdf_to_images_bgr(path, zoom=zoom)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for i, img in enumerate(imgs, start=1):
+        _save_atomic(cache_dir / f"p{i:03d}.npy", lambda fh, img=img: np.save(fh, img))
+    _save_atomic(marker, lambda fh: fh.write(str(len(imgs)).encode()))
+    try:
+        _evict_pages_cache(cache_dir)
+    except OSError:
+        pass   # el desalojo nunca hace fallar el OCR: se repite al escribir la siguiente entrada
+    return imgs
+
+_SOLO_LETRAS = TablaFiltro(str.isalpha)
 
 def parse_amount_to_float(s) -> float:
     if s is None: return np.nan
-    m = EXTRACT_AMOUNT_RE.search(str(s))
+    ss = str(s).strip()
+    if not ss: return np.nan
+    if _FAST_AMOUNT.fullmatch(ss):
+        return float(ss.replace(',', ''))
+    m = EXTRACT_AMOUNT_RE.search(ss)
     if not m:
-        digits = ''.join(ch for ch in str(s) if ch.isdigit())
+        digits = only_digits(ss)
         return float(digits) if digits else np.nan
     token = m.group(1)
     last_dot, last_comma = token.rfind('.'), token.rfind(',')
@@ -76,48 +183,59 @@ def parse_amount_to_float(s) -> float:
     except Exception:
         return np.nan
 
-def y_center(bb): return int((bb[0][1] + bb[2][1]) / 2)
-def x_left(bb):   return int(min(p[0] for p in bb))
-def in_band_center(bb, xs, xe):
-    xc = (bb[0][0] + bb[2][0]) / 2.0
-    return xs <= xc < xe
-
-def group_tokens_by_y(tokens, y_tol=ROW_Y_TOL):
-    items = [(y_center(bb), x_left(bb), bb, txt) for bb, txt in tokens]
-    items.sort(key=lambda z: z[0])
-    lines, cur, last_y = [], [], None
-    for yc, xl, bb, txt in items:
-        if last_y is None or abs(yc - last_y) <= y_tol:
-            cur.append((xl, txt, bb, yc))
-        else:
-            lines.append(cur); cur = [(xl, txt, bb, yc)]
-        last_y = yc
-    if cur: lines.append(cur)
+def parse_amount_column(col: pd.Series) -> pd.Series:
+    """parse_amount_to_float sobre una columna completa, en una sola pasada a float64."""
+    return pd.Series([parse_amount_to_float(v) for v in col.tolist()], index=col.index, dtype=np.float64)
+
+def token_arrays(results):
+    """OCR (lista de (caja, texto, conf)) como arreglos paralelos (SoA): cajas (N,4,2) y textos."""
+    boxes = np.asarray([r[0] for r in results], dtype=np.float64).reshape(len(results), 4, 2)
+    texts = np.array([r[1] for r in results], dtype=object)
+    return boxes, texts
+
+def _geom(boxes):
+    """Extremos de las cajas (N,4,2): x_min, x_max, y_min, y_max por token."""
+    return boxes[:, :, 0].min(axis=1), boxes[:, :, 0].max(axis=1), boxes[:, :, 1].min(axis=1), boxes[:, :, 1].max(axis=1)
+
+def band_of(xs, bands):
+    """Para cada x, posición (en el orden de `bands`) de la banda [xs, xe) que lo contiene;
+    -1 si ninguna. Las bandas no se traslapan: una búsqueda binaria sobre los inicios basta."""
+    starts = np.array([xs0 for xs0, _xe in bands.values()], dtype=np.float64)
+    ends = np.array([xe for _xs, xe in bands.values()], dtype=np.float64)
+    order = np.argsort(starts, kind="stable")
+    k = np.searchsorted(starts[order], xs, side="right") - 1
+    pos = order[np.maximum(k, 0)]
+    return np.where((k >= 0) & (xs < ends[pos]), pos, -1)
+
+def group_tokens_by_y(idx, yc, xl, texts, y_tol=ROW_Y_TOL):
+    """Agrupa en líneas los tokens `idx` (índices sobre los arreglos SoA).
+    Devuelve [(y_mediana, texto unido de izquierda a derecha, índices de la línea)]."""
+    if not len(idx):
+        return []
+    idx = idx[np.argsort(yc[idx], kind="stable")]
+    # nueva línea donde el salto entre Y consecutivas supera la tolerancia
+    lines = np.split(idx, np.flatnonzero(np.diff(yc[idx]) > y_tol) + 1)
     out = []
     for line in lines:
-        line.sort(key=lambda z: z[0])
-        yc = int(np.median([z[3] for z in line]))
-        txt = " ".join(z[1] for z in line)
-        out.append((yc, txt, [z[2] for z in line]))
+        line = line[np.argsort(xl[line], kind="stable")]
+        out.append((int(np.median(yc[line])), " ".join(texts[line]), line))
     return out
 
-def bbox_union(bboxes):
-    xs = [p[0] for bb in bboxes for p in bb]
-    ys = [p[1] for bb in bboxes for p in bb]
-    return [(min(xs), min(ys)), (max(xs), min(ys)), (max(xs), max(ys)), (min(xs), max(ys))]
-
 # ---------- Normalización de FECHA (OPER) ----------
 MESES_ABBR = "ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC"
 RX_DD_MES_SEP   = re.compile(rf'\b([0-3]?\d)[/Iil|\- ]+({MESES_ABBR})\b', re.I)
 RX_DD_MES_NOSEP = re.compile(rf'\b([0-3]?\d)({MESES_ABBR})\b', re.I)
 RX_DD_MM        = re.compile(r'\b([0-3]?\d)[/Iil|\- ]+([01]?\d)\b')
 
+_OPER_TRANS = str.maketrans({'I': '/', 'L': '/', '|': '/'})
+
+@lru_cache(maxsize=8192)
 def normalize_oper_fecha(raw: str) -> str:
     s = raw.upper()
-    s = s.replace('I','/').replace('L','/').replace('|','/')
-    s = re.sub(r'(?<=\d)O','0', s)
-    s = re.sub(r'O(?=\d)','0', s)
-    s = re.sub(r'\s+','', s)
+    s = s.translate(_OPER_TRANS)
+    s = RX_O_TRAS_DIGITO.sub('0', s)
+    s = RX_O_ANTES_DIGITO.sub('0', s)
+    s = RX_WS.sub('', s)
     m = RX_DD_MES_SEP.search(s)
     if m:
         d, mon = int(m.group(1)), m.group(2)[:3].upper()
@@ -146,7 +264,7 @@ def extract_ref_from_text_after_ref_block(text: str) -> str:
     if not m:
         return ""
     tail = m.group(1)
-    digits = "".join(ch for ch in tail if ch.isdigit())
+    digits = only_digits(tail)
     return digits if len(digits) >= 2 else ""
 
 def split_concept_and_ref_from_line(text: str):
@@ -157,13 +275,13 @@ def split_concept_and_ref_from_line(text: str):
     ref = ""
     if m:
         tail = m.group(1)
-        ref = "".join(ch for ch in tail if ch.isdigit())
+        ref = only_digits(tail)
         s = s[:m.start()].strip(" -,:;")
 
     # 2) normalizaciones puntuales del concepto
-    s = re.sub(r'\bAAZ\b', 'AA7', s, flags=re.I)      # OCR común AAZ -> AA7
+    s = RX_AAZ.sub('AA7', s)                          # OCR común AAZ -> AA7
     s = NOISE_CONCEPTO_RX.sub('', s)                  # quita OSIMAY / O6IMAY solo en CONCEPTO
-    s = re.sub(r'\s{2,}', ' ', s).strip(" -,:;")      # limpia espacios/puntuación sobrante
+    s = RX_WS_MULTI.sub(' ', s).strip(" -,:;")        # limpia espacios/puntuación sobrante
 
     return s, (ref if len(ref) >= 2 else "")
 
@@ -174,29 +292,46 @@ KEY_TOKENS = [
     "BAJIO","INBURSA","SCOTIA","SCOTIABANK","DEPOSITO","COBRO","ABONO","CARGO",
     "OSIMAY","O6IMAY"  # se usan para detectar la línea; luego se limpian del concepto
 ]
-KEY_TOKENS_RX = re.compile("|".join(map(re.escape, KEY_TOKENS)), re.I)
-MONEY_LIKE_RX = re.compile(r'\d{1,3}(?:[ ,]\d{3})*(?:[.,]\d{2})')
+MONEY_LIKE = r'\d{1,3}(?:[ ,]\d{3})*(?:[.,]\d{2})'
+# Inicio de línea: 'ref' o dígito (una sola comparación anclada)
+RX_INICIO_LINEA = re.compile(r'\s*(?:(?P<ref>ref)|(?P<digit>\d))', re.I)
+# Palabra clave o monto en una sola pasada. Son lookaheads (ancho cero) para que un hallazgo
+# no consuma el texto de otro; las claves empiezan con letra y los montos con dígito.
+RX_CLAVE_O_MONTO = re.compile(
+    rf"(?=(?P<kw>{'|'.join(map(re.escape, KEY_TOKENS))})|(?P<money>{MONEY_LIKE}))", re.I)
 
 def _char_stats(s: str):
-    s2 = "".join(s.split())
-    letters = sum(ch.isalpha() for ch in s2)
-    digits  = sum(ch.isdigit() for ch in s2)
-    return letters, digits, len(s2)
+    # espacios no son letras ni dígitos: se cuentan sobre el texto completo
+    letters = len(s.translate(_SOLO_LETRAS))
+    digits  = len(s.translate(SOLO_DIGITOS))
+    return letters, digits, len("".join(s.split()))
+
+# Rasgos de texto de una línea de concepto, en el orden que espera el scoring
+N_FEATS = 6  # has_letters, digit_ratio, starts_with_ref, starts_with_digit, has_keyword, has_money_like
 
-def score_concept_line_for_anchor(y_anchor, line_h_est, txt, bbs, amount_y_tol, amount_hits, xs_band):
+def concept_line_features(txt):
+    """Rasgos de texto (regex) de una línea de concepto; se calculan una vez por línea."""
     letters, digits, nall = _char_stats(txt)
-    has_letters = letters >= 1
     digit_ratio = 0 if nall == 0 else digits / nall
-    starts_with_ref   = bool(re.match(r'(?i)^\s*ref', txt))
-    starts_with_digit = bool(re.match(r'^\s*\d', txt))
-    has_keyword       = bool(KEY_TOKENS_RX.search(txt))
-    has_money_like    = bool(MONEY_LIKE_RX.search(txt))
-
-    ub = bbox_union(bbs)
-    x_l = ub[0][0]; width = ub[1][0] - ub[0][0]
-    y_desc = int((ub[0][1] + ub[2][1]) / 2)
-
-    has_amount_same_line = any(abs(d["y"] - y_desc) <= amount_y_tol for d in amount_hits)
+    m = RX_INICIO_LINEA.match(txt)
+    starts_with_ref   = bool(m and m.group("ref"))
+    starts_with_digit = bool(m and m.group("digit"))
+    has_keyword = has_money_like = False
+    for m in RX_CLAVE_O_MONTO.finditer(txt):
+        if m.group("kw") is not None:
+            has_keyword = True
+        else:
+            has_money_like = True
+        if has_keyword and has_money_like:
+            break
+    return (letters >= 1, digit_ratio, starts_with_ref, starts_with_digit, has_keyword, has_money_like)
+
+def score_concept_line_for_anchor(y_anchor, line_h_est, feats, x_l, width, y_desc, has_amount_same_line, xs_band):
+    """Puntaje de una línea de concepto para el monto en `y_anchor`.
+    Sólo aritmética: `feats` viene de concept_line_features; x_l/width/y_desc de la unión
+    de cajas de la línea; has_amount_same_line si algún monto cae en su misma fila."""
+    has_letters, digit_ratio, starts_with_ref, starts_with_digit, has_keyword, has_money_like = (
+        feats[0], feats[1], feats[2], feats[3], feats[4], feats[5])
 
     dy = abs(y_desc - y_anchor)
     score = 0.0
@@ -220,69 +355,97 @@ def score_concept_line_for_anchor(y_anchor, line_h_est, txt, bbs, amount_y_tol,
         score += 0.8
     return score
 
+def best_concept_line(y_anchor, line_h_est, lo, hi, feats, x_l, width, y_desc, same_line, xs_band):
+    """Índice de la línea con mayor puntaje en [lo, hi) (la primera en empate); -1 si no hay."""
+    best_j = -1
+    best_score = 0.0
+    for j in range(lo, hi):
+        s = score_concept_line_for_anchor(y_anchor, line_h_est, feats[j], x_l[j], width[j],
+                                          y_desc[j], same_line[j], xs_band)
+        if best_j < 0 or s > best_score:
+            best_score, best_j = s, j
+    return best_j
+
+if NUMBA_AVAILABLE:
+    score_concept_line_for_anchor = njit(cache=True)(score_concept_line_for_anchor)
+    best_concept_line = njit(cache=True)(best_concept_line)
+
 # =========================
 # OCR por página (mantenemos montos intactos)
 # =========================
-def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None) -> pd.DataFrame:
-    img_crop = img_bgr[90:img_bgr.shape[0]-60, :]
-    results = reader.readtext(img_crop, detail=1, paragraph=False)
+def crop_page(img_bgr: np.ndarray) -> np.ndarray:
+    return img_bgr[TOP_CROP: img_bgr.shape[0]-BOTTOM_CROP, :]
+
+def ocr_input(img_bgr: np.ndarray) -> np.ndarray:
+    """Recorte en escala de grises para el OCR: el estado de cuenta es texto monocromo y
+    EasyOCR acepta un canal, así que se le pasa 1/3 de los bytes."""
+    return cv2.cvtColor(crop_page(img_bgr), cv2.COLOR_BGR2GRAY)
+
+# Columnas de los movimientos por página y del DataFrame final
+OUT_COLS = ["FECHA", "CONCEPTO", "REFERENCIA", "TIPO", "MONTO", "SALDO"]
+
+def ocr_pagina_cols(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None, results=None) -> dict:
+    """Movimientos de una página como columnas (dict OUT_COLS -> lista). `results` es el OCR
+    (formato readtext) del recorte crop_page(img_bgr); si no se da, se hace aquí."""
+    img_crop = crop_page(img_bgr)
+    if results is None:
+        results = get_reader().readtext(ocr_input(img_bgr), detail=1, paragraph=False)
+
+    # OCR como arreglos paralelos (SoA): extremos y centros de todos los tokens de una vez
+    boxes, texts = token_arrays(results)
+    x_mins, x_maxs, y_mins, y_maxs = _geom(boxes)
+    x_lefts = x_mins.astype(np.int64)
+    y_centers = ((boxes[:, 0, 1] + boxes[:, 2, 1]) / 2).astype(np.int64)
+    x_centers = (boxes[:, 0, 0] + boxes[:, 2, 0]) / 2.0
 
     # ---------- Montos (intacto) ----------
-    amount_hits = []
-    for box, txt, _ in results:
-        x_min = min(p[0] for p in box)
-        for col, (xs, xe) in COLUMNAS.items():
-            if xs <= x_min < xe and MONTOS.match(re.sub(r"\s", "", txt)):
-                amount_hits.append({"y": min(p[1] for p in box), "col": col, "text": re.sub(r"\s", "", txt), "bbox": box})
-                break
-
-    # Agrupo montos por filas y guardo anclas de Y
-    row_groups, current, last_y = [], [], None
-    for d in sorted(amount_hits, key=lambda r: r["y"]):
-        if last_y is None or abs(d["y"] - last_y) < 15:
-            current.append(d)
-        else:
-            row_groups.append(current); current = [d]
-        last_y = d["y"]
-    if current: row_groups.append(current)
-
-    rows = []
-    anchors_y = []
-    for g in row_groups:
-        row = {}
-        for it in g:
-            row[it["col"]] = it["text"]
-        rows.append(row)
-        ys = [int((it["bbox"][0][1] + it["bbox"][2][1]) / 2) for it in g]
-        anchors_y.append(int(np.median(ys)) if ys else None)
-
-    df_montos = (pd.DataFrame(rows)
-        .rename(columns={"LIQUIDACI": "SALDO"})
-        .reindex(columns=["CARGOS","ABONOS","SALDO"])
-        .fillna(""))
+    # columna de monto por x mínima; sólo esos tokens pasan por MONTOS
+    amount_names = list(COLUMNAS)
+    amount_band = band_of(x_mins, COLUMNAS)
+    amount_idx, amount_cols, amount_texts = [], [], []
+    for i in np.flatnonzero(amount_band >= 0).tolist():
+        compact = RX_WS.sub("", texts[i])
+        if MONTOS.match(compact):
+            amount_idx.append(i)
+            amount_cols.append(amount_names[amount_band[i]])
+            amount_texts.append(compact)
+
+    # Sin montos no hay movimientos (portadas, resúmenes): no vale la pena mirar el texto
+    if not amount_idx:
+        return {col: [] for col in OUT_COLS}
+
+    # Agrupo montos por filas (corte donde el salto en Y llega a 15 px) y guardo anclas de Y
+    amount_idx = np.array(amount_idx, dtype=np.int64)
+    amount_ys = y_mins[amount_idx]
+    order = np.argsort(amount_ys, kind="stable")
+    row_groups = np.split(order, np.flatnonzero(np.diff(amount_ys[order]) >= 15) + 1)
+
+    # Montos por columna: un arreglo por columna (LIQUIDACI -> SALDO), "" donde la fila no trae
+    monto_cols = {col: np.full(len(row_groups), "", dtype=object) for col in ("CARGOS", "ABONOS", "SALDO")}
+    for r, g in enumerate(row_groups):
+        for h in g.tolist():
+            monto_cols["SALDO" if amount_cols[h] == "LIQUIDACI" else amount_cols[h]][r] = amount_texts[h]
+    anchors_y = np.array([int(np.median(y_centers[amount_idx[g]])) for g in row_groups], dtype=np.int64)
+
+    df_montos = pd.DataFrame(monto_cols, copy=False)
 
     # Puerta vertical por montos
-    has_any_monto = len(amount_hits) > 0
-    if amount_hits:
-        y_min_tab = min(min(pt[1] for pt in d["bbox"]) for d in amount_hits)
-        y_max_tab = max(max(pt[1] for pt in d["bbox"]) for d in amount_hits)
-        y_low_gate = max(0, y_min_tab - 30)
-        y_high_gate = y_max_tab + 30
-    else:
-        y_low_gate, y_high_gate = 0, img_crop.shape[0]
-
-    oper_tokens = [(bb, txt) for (bb, txt, _) in results
-                   if in_band_center(bb, *TEXT_COLS["OPER"]) and y_low_gate <= y_center(bb) <= y_high_gate]
-    desc_tokens = [(bb, txt) for (bb, txt, _) in results
-                   if in_band_center(bb, *TEXT_COLS["COD_DESC"]) and y_low_gate <= y_center(bb) <= y_high_gate]
-
-    oper_lines_all = group_tokens_by_y(oper_tokens, y_tol=ROW_Y_TOL)
+    y_low_gate = max(0, y_mins[amount_idx].min() - 30)
+    y_high_gate = y_maxs[amount_idx].max() + 30
+
+    # columnas de texto por x centro, dentro de la puerta vertical
+    text_band = band_of(x_centers, TEXT_COLS)
+    text_band[(y_centers < y_low_gate) | (y_centers > y_high_gate)] = -1
+    text_cols = list(TEXT_COLS)
+    oper_idx = np.flatnonzero(text_band == text_cols.index("OPER"))
+    desc_idx = np.flatnonzero(text_band == text_cols.index("COD_DESC"))
+    if not len(desc_idx):
+        return {col: [] for col in OUT_COLS}
+
+    oper_lines_all = group_tokens_by_y(oper_idx, y_centers, x_lefts, texts, y_tol=ROW_Y_TOL)
     # FECHA: cualquier línea con dígitos; luego normalizo
-    oper_lines = [(y, t.strip(), bbs) for (y, t, bbs) in oper_lines_all if re.search(r"\d", t)]
-    desc_lines_full = group_tokens_by_y(desc_tokens, y_tol=ROW_Y_TOL)
-
-    if not has_any_monto or not desc_lines_full:
-        return pd.DataFrame(columns=["FECHA","CONCEPTO","REFERENCIA","TIPO","MONTO","SALDO"])
+    oper_lines = [(y, t.strip(), line) for (y, t, line) in oper_lines_all if RX_HAS_DIGIT.search(t)]
+    desc_lines_full = group_tokens_by_y(desc_idx, y_centers, x_lefts, texts, y_tol=ROW_Y_TOL)
 
     oper_lines.sort(key=lambda z: z[0])
     desc_lines_full.sort(key=lambda z: z[0])
@@ -296,28 +459,43 @@ def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None)
     AMOUNT_Y_TOL = max(ROW_Y_TOL, int(0.6*line_h))
 
     # Filtrado de filas inválidas (solo para alinear con anchors; NO afecta montos en salida)
-    invalid = ((df_montos["SALDO"].astype(str).str.strip()!="") &
-               (df_montos["CARGOS"].astype(str).str.strip()=="") &
-               (df_montos["ABONOS"].astype(str).str.strip()==""))
-    valid_idx = [i for i in range(len(df_montos)) if not (invalid.iloc[i] if i < len(invalid) else False)]
-    anchors_y_valid = [anchors_y[i] for i in valid_idx] if valid_idx else []
-
-    # Prepara ayuda para fecha por ancla: buscamos la última oper <= y_anchor
-    oper_y = [y for (y,_,_) in oper_lines]
-    def fecha_for_anchor(y_anchor):
-        # último oper por encima (o muy cerca)
-        prev = [ (y,t) for (y,t,_) in oper_lines if y <= y_anchor + int(0.25*line_h) ]
-        if prev:
-            y,t = prev[-1]
-            return normalize_oper_fecha(t)
-        # si no hay por arriba, toma el más cercano
-        if oper_lines:
-            y,t,_ = min(oper_lines, key=lambda it: abs(it[0]-y_anchor))
-            return normalize_oper_fecha(t)
-        return ""
-
-    # Índices de desc_lines por Y para cortes rápidos
-    desc_Ys = [y for (y,_,_) in desc_lines_full]
+    # (los textos de monto ya vienen compactados: basta comparar contra "")
+    invalid = ((monto_cols["SALDO"] != "") &
+               (monto_cols["CARGOS"] == "") &
+               (monto_cols["ABONOS"] == ""))
+    anchors_y_valid = anchors_y[np.flatnonzero(~invalid)]
+
+    # FECHA por ancla: la última oper por encima (o muy cerca) de cada ancla, todas en una
+    # búsqueda binaria sobre las Y ya ordenadas; si no hay por arriba, la más cercana
+    oper_ys = np.array([y for (y,_,_) in oper_lines], dtype=np.int64)
+    prev_idx = np.searchsorted(oper_ys, anchors_y_valid + int(0.25*line_h), side="right") - 1
+    fechas_anchor = []
+    for y_anchor, j in zip(anchors_y_valid.tolist(), prev_idx.tolist()):
+        if j < 0:
+            if not len(oper_ys):
+                fechas_anchor.append("")
+                continue
+            j = int(np.argmin(np.abs(oper_ys - y_anchor)))
+        fechas_anchor.append(normalize_oper_fecha(oper_lines[j][1]))
+
+    # Y de desc_lines (ordenadas): cada ventana es un tramo [lo, hi) por búsqueda binaria
+    desc_ys = np.array([y for (y,_,_) in desc_lines_full], dtype=np.int64)
+    # Todo lo que no depende del anchor se calcula una vez por línea de descripción:
+    # rasgos de texto, unión de cajas y si hay un monto en su misma fila
+    n_desc = len(desc_lines_full)
+    desc_feats = np.array([concept_line_features(t) for (_y, t, _l) in desc_lines_full],
+                          dtype=np.float64).reshape(n_desc, N_FEATS)
+    desc_box = np.array([(x_mins[line].min(), x_maxs[line].max(), y_mins[line].min(), y_maxs[line].max())
+                         for (_y, _t, line) in desc_lines_full], dtype=np.float64).reshape(n_desc, 4)
+    desc_xl = desc_box[:, 0]
+    desc_w = desc_box[:, 1] - desc_box[:, 0]
+    desc_ymid = ((desc_box[:, 2] + desc_box[:, 3]) / 2).astype(np.int64)
+    desc_same_line = (np.abs(amount_ys[None, :] - desc_ymid[:, None]) <= AMOUNT_Y_TOL).any(axis=1)
+    xs_band = float(TEXT_COLS["COD_DESC"][0])
+
+    def desc_window(y0, y1):
+        return (int(np.searchsorted(desc_ys, y0, side="left")),
+                int(np.searchsorted(desc_ys, y1, side="right")))
 
     conceptos = []
     for k, y_anchor in enumerate(anchors_y_valid):
@@ -327,42 +505,27 @@ def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None)
         y0 = y_anchor - win_up
         y1 = y_anchor + win_down
 
-        cand = [ (j,desc_lines_full[j]) for j in range(len(desc_lines_full))
-                 if y0 <= desc_lines_full[j][0] <= y1 ]
+        lo, hi = desc_window(y0, y1)
 
         # si no hay, ampliamos
-        if not cand:
+        if lo >= hi:
             y0 = y_anchor - 2*line_h
             y1 = y_anchor + int(0.6*line_h)
-            cand = [ (j,desc_lines_full[j]) for j in range(len(desc_lines_full))
-                     if y0 <= desc_lines_full[j][0] <= y1 ]
+            lo, hi = desc_window(y0, y1)
 
         # Scoring por anchor
-        best_j, best_score = None, None
-        for j,(y_desc, txt, bbs) in cand:
-            s = score_concept_line_for_anchor(
-                    y_anchor=y_anchor,
-                    line_h_est=line_h,
-                    txt=txt,
-                    bbs=bbs,
-                    amount_y_tol=AMOUNT_Y_TOL,
-                    amount_hits=amount_hits,
-                    xs_band=TEXT_COLS["COD_DESC"][0]
-                )
-            if (best_score is None) or (s > best_score):
-                best_score, best_j = s, j
-
-        if best_j is None:
+        best_j = int(best_concept_line(y_anchor, line_h, lo, hi, desc_feats, desc_xl, desc_w,
+                                       desc_ymid, desc_same_line, xs_band))
+
+        if best_j < 0:
             # Fallback: coge la línea desc más cercana hacia arriba
-            upper = [ (j,desc_lines_full[j]) for j in range(len(desc_lines_full)) if desc_lines_full[j][0] <= y_anchor ]
-            if upper:
-                best_j = upper[-1][0]
-            else:
+            best_j = int(np.searchsorted(desc_ys, y_anchor, side="right")) - 1
+            if best_j < 0:
                 # o la 1a por debajo
                 best_j = 0
 
         # Concepto de la línea elegida (limpieza + posible ref en esa línea)
-        _, line1, _bbs1 = desc_lines_full[best_j]
+        _, line1, _idx1 = desc_lines_full[best_j]
         concept_text, ref_inline = split_concept_and_ref_from_line(line1)
 
         # Busca REF en las siguientes hasta topar con el siguiente anchor
@@ -377,54 +540,58 @@ def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None)
             if next_anchor is not None and y2 >= next_anchor - max(ROW_Y_TOL, int(0.4*line_h)):
                 break
             # prioriza línea con 'ref'
-            if re.search(r'(?i)\bref', txt2):
+            if RX_REF_WORD.search(txt2):
                 r2 = extract_ref_from_text_after_ref_block(txt2)
                 if r2:
                     referencia = r2
             else:
                 # fallback: por si partieron la referencia sin 'ref'
-                digits = "".join(ch for ch in txt2 if ch.isdigit())
+                digits = only_digits(txt2)
                 if len(digits) >= 4 and (len(digits) > len(referencia or "")):
                     referencia = digits
             j2 += 1
             follow += 1
 
         # FECHA mapeada por anchor
-        fecha = fecha_for_anchor(y_anchor)
+        fecha = fechas_anchor[k]
 
         conceptos.append((fecha, concept_text, referencia))
 
     # ---------- TIPO/MONTO/SALDO (NO se toca la lógica) ----------
     if invalid.any():
-        df_montos = df_montos[~invalid].reset_index(drop=True)
+        df_montos = df_montos.loc[~invalid].reset_index(drop=True)
 
-    cargos = df_montos["CARGOS"].apply(parse_amount_to_float) if "CARGOS" in df_montos else pd.Series([])
-    abonos = df_montos["ABONOS"].apply(parse_amount_to_float) if "ABONOS" in df_montos else pd.Series([])
-    saldos = df_montos["SALDO"].apply(parse_amount_to_float) if "SALDO" in df_montos else pd.Series([])
+    cargos = parse_amount_column(df_montos["CARGOS"]) if "CARGOS" in df_montos else pd.Series([])
+    abonos = parse_amount_column(df_montos["ABONOS"]) if "ABONOS" in df_montos else pd.Series([])
+    saldos = parse_amount_column(df_montos["SALDO"]) if "SALDO" in df_montos else pd.Series([])
     n_rows = max(len(cargos), len(abonos), len(saldos))
     cargos, abonos, saldos = [s.reindex(range(n_rows)) for s in (cargos,abonos,saldos)]
 
     # Ahora conceptos está alineado 1 a 1 con anchors válidos = n_rows
-    df_fc = pd.DataFrame(conceptos, columns=["FECHA","CONCEPTO","REFERENCIA"])
-    if len(df_fc) != n_rows:
-        # si por algún borde quedaron menos, reindex sin ffill (prefiero vacío a arrastrar)
-        df_fc = df_fc.reindex(range(n_rows)).fillna({"FECHA":"", "CONCEPTO":"", "REFERENCIA":""})
-
-    tipos, montos = [], []
-    for c, a in zip(cargos.tolist(), abonos.tolist()):
-        c_ok, a_ok = not pd.isna(c), not pd.isna(a)
-        if c_ok and a_ok: tipos.append("CARGO" if c>=a else "ABONO"); montos.append(max(c,a))
-        elif c_ok:        tipos.append("CARGO"); montos.append(c)
-        elif a_ok:        tipos.append("ABONO"); montos.append(a)
-        else:             tipos.append(""); montos.append(np.nan)
-    df_tms = pd.DataFrame({"TIPO": tipos, "MONTO": montos, "SALDO": saldos}).round(2)
-
-    out = pd.concat([df_fc, df_tms], axis=1)
+    # si por algún borde quedaron menos, se completa con vacío (prefiero vacío a arrastrar)
+    conceptos = conceptos[:n_rows] + [("", "", "")] * (n_rows - len(conceptos))
+    fechas = [f for f, _c, _r in conceptos]
+    textos = [c for _f, c, _r in conceptos]
+    refs = [r for _f, _c, r in conceptos]
+
+    # con ambos montos gana el mayor (empate = CARGO); con uno solo, ese
+    c = cargos.to_numpy(dtype=np.float64)
+    a = abonos.to_numpy(dtype=np.float64)
+    c_ok, a_ok = ~np.isnan(c), ~np.isnan(a)
+    es_cargo = c_ok & (~a_ok | (c >= a))
+    es_abono = a_ok & ~es_cargo
+    tipos = np.full(n_rows, "", dtype=object)
+    tipos[es_cargo] = "CARGO"
+    tipos[es_abono] = "ABONO"
+    montos = np.where(es_cargo, c, a)
 
     # Dedup de referencias: vacía duplicadas (no borra filas)
-    mask_ref_valid = out["REFERENCIA"].astype(str).str.fullmatch(r"\d{2,}")
-    dupe_mask = mask_ref_valid & out.duplicated(subset=["REFERENCIA"], keep="first")
-    out.loc[dupe_mask, "REFERENCIA"] = ""
+    vistas = set()
+    for i, r in enumerate(refs):
+        if RX_REF_VALIDA.fullmatch(r):
+            if r in vistas:
+                refs[i] = ""
+            vistas.add(r)
 
     # Debug (opcional): bandas
     if SAVE_DEBUG and debug_dir is not None:
@@ -437,7 +604,32 @@ def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None)
             cv2.rectangle(vis, (xs,0), (xe,h), COLOR_BAND[k], 2); cv2.putText(vis, k, (xs+4, 40 if k=="COD_DESC" else 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLOR_BAND[k], 2)
         cv2.imwrite(str(debug_dir / f"p{page_num:03d}_anchors_by_row.png"), vis)
 
-    return out.reset_index(drop=True)
+    return {
+        "FECHA": fechas,
+        "CONCEPTO": textos,
+        "REFERENCIA": refs,
+        "TIPO": tipos.tolist(),
+        "MONTO": np.round(montos, 2).tolist(),
+        "SALDO": np.round(saldos.to_numpy(dtype=np.float64), 2).tolist(),
+    }
+
+def ocr_pagina_unico(img_bgr: np.ndarray, page_num: int, debug_dir: Path | None, results=None) -> pd.DataFrame:
+    """Movimientos de una página como DataFrame (OUT_COLS)."""
+    return pd.DataFrame(ocr_pagina_cols(img_bgr, page_num, debug_dir, results=results), columns=OUT_COLS)
+
+# =========================
+# OCR en paralelo por bloques de páginas
+# =========================
+def _ocr_pages_chunk(first_page, pages, debug_dir):
+    """OCR en lote + extracción de un bloque contiguo de páginas (columnas por página)."""
+    results_list = ocr_pages_batched([ocr_input(img) for img in pages], get_reader())
+    return [ocr_pagina_cols(img, page_num=first_page + k, debug_dir=debug_dir, results=results)
+            for k, (img, results) in enumerate(zip(pages, results_list))]
+
+def ocr_pages(pages, debug_dir: Path | None = None, workers: int | None = None) -> list:
+    """Devuelve las columnas (ocr_pagina_cols) de cada página, en el mismo orden que `pages`.
+    Con varios workers reparte bloques contiguos de páginas entre procesos."""
+    return map_page_chunks(_ocr_pages_chunk, pages, debug_dir, workers=workers or OCR_WORKERS)
 
 # =========================
 # WRAPPER PARA INTEGRACIÓN EN FLUJO (NO MODIFICA LÓGICA DE DETECCIÓN)
@@ -449,16 +641,14 @@ def process_bbva_pdf(pdf_path_in: str, debug_dir: Path | None = None) -> dict:
     No modifica la lógica de detección.
     """
     try:
-        # Directorios de salida/debug automáticos si no se proporcionan
-        base_dir = Path(__file__).parent
-        pdf_stem = Path(pdf_path_in).stem
-        out_dir = base_dir / "salidas" / pdf_stem
-        pages_dir = out_dir / "pages"
-        auto_debug_dir = out_dir / "debug"
-
-        # Crear carpetas si SAVE_DEBUG está activo (o si el usuario pasó un debug_dir)
-        debug_dir_to_use = debug_dir
+        # Directorios de salida/debug (automáticos si no se proporcionan), sólo con SAVE_DEBUG
+        debug_dir_to_use = None
+        pages_dir = None
         if SAVE_DEBUG:
+            out_dir = _BASE_DIR / "salidas" / Path(pdf_path_in).stem
+            pages_dir = out_dir / "pages"
+            auto_debug_dir = out_dir / "debug"
+            debug_dir_to_use = debug_dir
             pages_dir.mkdir(parents=True, exist_ok=True)
             if debug_dir_to_use is None:
                 auto_debug_dir.mkdir(parents=True, exist_ok=True)
@@ -466,18 +656,23 @@ def process_bbva_pdf(pdf_path_in: str, debug_dir: Path | None = None) -> dict:
             else:
                 Path(debug_dir_to_use).mkdir(parents=True, exist_ok=True)
 
-        pages = pdf_to_images_bgr(pdf_path_in, zoom=ZOOM)
-        dfs = []
-        for i, img in enumerate(pages, start=1):
-            # Guardar PNG de la página completa si está habilitado el debug
-            if SAVE_DEBUG:
+        if PAGES_CACHE:
+            pages = pdf_to_images_cached(pdf_path_in, zoom=ZOOM)
+        else:
+            pages = pdf_to_images_bgr(pdf_path_in, zoom=ZOOM)
+        # Guardar PNG de cada página completa si está habilitado el debug
+        if SAVE_DEBUG:
+            for i, img in enumerate(pages, start=1):
                 cv2.imwrite(str(pages_dir / f"p{i:03d}.png"), img)
 
-            dfp = ocr_pagina_unico(img, page_num=i, debug_dir=debug_dir_to_use if SAVE_DEBUG else None)
-            if not dfp.empty:
-                dfs.append(dfp)
+        # OCR repartido entre procesos; las columnas de todas las páginas se juntan en listas
+        # y el DataFrame se arma una sola vez
+        cols = {col: [] for col in OUT_COLS}
+        for page_cols in ocr_pages(pages, debug_dir=debug_dir_to_use):
+            for col in OUT_COLS:
+                cols[col].extend(page_cols[col])
 
-        if not dfs:
+        if not cols["FECHA"]:
             return {
                 'exito': True,
                 'mensaje': 'PDF BBVA procesado: 0 movimientos',
@@ -486,28 +681,31 @@ def process_bbva_pdf(pdf_path_in: str, debug_dir: Path | None = None) -> dict:
                 'archivo_procesado': pdf_path_in
             }
 
-        df_final = pd.concat(dfs, ignore_index=True)
-
-        movimientos = []
-        for _, row in df_final.iterrows():
-            tipo = str(row.get('TIPO', '')).upper() if 'TIPO' in row else ''
-            monto = row.get('MONTO') if 'MONTO' in row else None
-            cargos = float(monto) if (tipo == 'CARGO' and pd.notna(monto)) else None
-            abonos = float(monto) if (tipo == 'ABONO' and pd.notna(monto)) else None
-            saldo_val = row.get('SALDO') if 'SALDO' in row else None
-            try:
-                saldo = float(saldo_val) if pd.notna(saldo_val) else None
-            except Exception:
-                saldo = None
-
-            movimientos.append({
-                'fecha': row.get('FECHA', '') if 'FECHA' in row else '',
-                'concepto': row.get('CONCEPTO', '') if 'CONCEPTO' in row else '',
-                'referencia': row.get('REFERENCIA', '') if 'REFERENCIA' in row else '',
-                'cargos': cargos,
-                'abonos': abonos,
-                'saldo': saldo,
-            })
+        # Un arreglo 1D por columna (MONTO/SALDO ya como float64): cada columna queda en su propio bloque
+        df_final = pd.DataFrame({
+            col: np.asarray(cols[col], dtype=np.float64 if col in ("MONTO", "SALDO") else object)
+            for col in OUT_COLS
+        }, copy=False)
+
+        # Columnas completas: el MONTO va a cargos o abonos según TIPO; NaN -> None
+        tipo = df_final['TIPO'].astype(str).str.upper().to_numpy()
+        monto = df_final['MONTO'].to_numpy()
+        saldo = df_final['SALDO'].to_numpy()
+        cargos = np.where(tipo == 'CARGO', monto, np.nan).tolist()
+        abonos = np.where(tipo == 'ABONO', monto, np.nan).tolist()
+
+        movimientos = [
+            {
+                'fecha': f,
+                'concepto': c,
+                'referencia': r,
+                'cargos': None if math.isnan(x) else x,
+                'abonos': None if math.isnan(y) else y,
+                'saldo': None if math.isnan(z) else z,
+            }
+            for f, c, r, x, y, z in zip(df_final['FECHA'].tolist(), df_final['CONCEPTO'].tolist(),
+                                        df_final['REFERENCIA'].tolist(), cargos, abonos, saldo.tolist())
+        ]
 
         return {
             'exito': True,
@@ -4,19 +4,77 @@ Implementa el enfoque de 2 pasos: exacto y manual
 """
 
 import logging
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Optional, Set
 from dataclasses import dataclass
 from enum import Enum
 
-from sqlalchemy.orm import Session
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+from sqlalchemy.orm import Session, load_only
 from sqlalchemy import and_, or_, func
 
 from app.models.mysql_models import ComprobanteFiscal, DocumentoRelacionadoPago, ComplementoPago
 from app.conciliacion.models import MovimientoBancario, TipoMovimiento, EstadoConciliacion
+from app.utils.montos import centavos
 
 logger = logging.getLogger(__name__)
 
+_DIA_US = 86_400_000_000  # un día en µs
+
+def _a_us(fechas) -> np.ndarray:
+    """datetime (o lista de datetimes) en microsegundos enteros, para comparar/buscar en arreglos."""
+    return np.asarray(fechas, dtype='datetime64[us]').astype(np.int64)
+
+def _mas_cercano_en_ventana(pos, ts, usado, ts_sel, ids, inicio, fin, dia_inicio, dia_fin, t_mov):
+    """
+    Elige en el grupo de un monto (`pos`/`ts` ordenados por fecha) el CFDI libre con fecha en
+    [inicio, fin], prefiriendo los del mismo día [dia_inicio, dia_fin]; entre ellos el más
+    cercano a `t_mov` por `ts_sel`, luego la fecha más antigua y luego el menor id.
+    Devuelve (posición, es_mismo_dia); posición -1 si no hay candidato.
+    """
+    lo = np.searchsorted(ts, inicio, side='left')
+    hi = np.searchsorted(ts, fin, side='right')
+    mejor, mejor_dia = -1, False
+    mejor_d = mejor_t = mejor_id = 0
+    # Sin salidas tempranas: la clave (no mismo día, |Δt|, t, id) se evalúa para todo el tramo
+    # y los usados sólo quedan fuera por la máscara
+    for j in range(lo, hi):
+        p = pos[j]
+        dia = dia_inicio <= ts[j] <= dia_fin
+        t = ts_sel[p]
+        d = abs(t - t_mov)
+        menor = d < mejor_d or (d == mejor_d and (t < mejor_t or (t == mejor_t and ids[p] < mejor_id)))
+        gana = (not usado[p]) and (mejor < 0 or (dia and not mejor_dia) or (dia == mejor_dia and menor))
+        if gana:
+            mejor, mejor_dia = p, dia
+            mejor_d, mejor_t, mejor_id = d, t, ids[p]
+    return mejor, mejor_dia
+
+if NUMBA_AVAILABLE:
+    _mas_cercano_en_ventana = njit(cache=True)(_mas_cercano_en_ventana)
+
+_kernel_listo = False
+
+def _calentar_kernel() -> None:
+    """
+    Compila (o carga de la caché) el kernel una sola vez por proceso con los mismos tipos que
+    usa la conciliación, para que el primer movimiento no pague la compilación.
+    """
+    global _kernel_listo
+    if _kernel_listo or not NUMBA_AVAILABLE:
+        return
+    uno = np.zeros(1, dtype=np.int64)
+    _mas_cercano_en_ventana(uno, uno, np.zeros(1, dtype=bool), uno, uno, 0, 0, 0, 0, 0)
+    _kernel_listo = True
+
 class TipoConciliacion(Enum):
     EXACTA = "exacta"
     PENDIENTE = "pendiente"
@@ -47,12 +105,34 @@ class ConciliadorMejorado:
         self.cfdi_usados: Set[int] = set()
         # Para detectar movimientos duplicados
         self.movimientos_por_fecha_monto: Dict[Tuple[str, float], List[int]] = {}
+        # CFDIs candidatos precargados como columnas paralelas (SoA), una posición por CFDI:
+        # el objeto ORM sólo se toca al elegir
+        self._cfdis: List[ComprobanteFiscal] = []
+        self._cfdi_montos: List[object] = []
+        self._cfdi_ids = np.empty(0, dtype=np.int64)
+        self._cfdi_ts = np.empty(0, dtype=np.int64)
+        # fecha de cercanía (fecha_timbrado, o fecha si no hay) en µs y máscara de ya asignados
+        self._cfdi_ts_sel = np.empty(0, dtype=np.int64)
+        self._cfdi_usado = np.zeros(0, dtype=bool)
+        # monto en centavos -> posiciones ordenadas por (fecha, id) y sus fechas (µs) para búsqueda binaria
+        self._pos_por_monto: Dict[int, np.ndarray] = {}
+        self._ts_por_monto: Dict[int, np.ndarray] = {}
+        # (día, monto en centavos) -> posiciones: índice invertido para contar CFDIs por día y monto
+        self._pos_por_dia_monto: Dict[Tuple[object, int], List[int]] = {}
+        # monto_pago del (primer) complemento de cada CFDI tipo P ya consultado
+        self._montos_pago: Dict[int, object] = {}
+        # Movimientos y CFDIs ya cargados por id, para no consultarlos de nuevo por cada resultado
+        self._movimientos_por_id: Dict[int, MovimientoBancario] = {}
+        self._cfdi_por_id: Dict[int, ComprobanteFiscal] = {}
+        _calentar_kernel()
         
     def conciliar_movimientos(self, movimientos: List[MovimientoBancario]) -> List[ResultadoConciliacion]:
         """
         Proceso principal de conciliación con 2 pasos
         """
         resultados = []
+        self._movimientos_por_id.update((m.id, m) for m in movimientos)
+        self._precargar_datos(movimientos)
         
         for movimiento in movimientos:
             logger.info(f"🔍 Conciliando movimiento {movimiento.id}: {movimiento.concepto}")
@@ -84,126 +164,162 @@ class ConciliadorMejorado:
     def _buscar_coincidencia_exacta(self, movimiento: MovimientoBancario) -> Optional[ResultadoConciliacion]:
         """
         Paso 1: Filtro Estricto - Coincidencia Exacta
-        Busca CFDI con fecha y monto exactos
+        Busca CFDI con fecha y monto exactos: primero en el mismo día y, si no hay,
+        en ±1 día. Una sola búsqueda sobre la ventana ±1 día (que contiene al día)
+        sirve para ambos pasos.
         """
-        # 1) Mismo día (00:00-23:59)
-        # Convertir date a datetime para poder usar replace con hora
+        # Monto exacto al centavo; para tipo P el monto es monto_pago del complemento
+        k = centavos(movimiento.monto)
+        ts = self._ts_por_monto.get(k)
+        if ts is None:
+            return None
+
+        # Ventanas en µs enteros: una sola conversión de la fecha y el resto es aritmética
         if hasattr(movimiento.fecha, 'date'):  # Es datetime
-            day_start = movimiento.fecha.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day_start + timedelta(days=1) - timedelta(microseconds=1)
+            t_mov = int(_a_us(movimiento.fecha))
+            day_start = t_mov - t_mov % _DIA_US
+            day_end = day_start + _DIA_US - 1           # 1) Mismo día (00:00-23:59)
         else:  # Es date
-            day_start = datetime.combine(movimiento.fecha, datetime.min.time())
-            day_end = datetime.combine(movimiento.fecha + timedelta(days=1), datetime.min.time())
+            t_mov = int(_a_us(datetime.combine(movimiento.fecha, datetime.min.time())))
+            day_start = t_mov
+            day_end = day_start + _DIA_US               # hasta las 00:00 del día siguiente
+        # 2) Fallback ±1 día (estricto)
+        fecha_inicio, fecha_fin = t_mov - _DIA_US, t_mov + _DIA_US
+
+        i, mismo_dia = _mas_cercano_en_ventana(
+            self._pos_por_monto[k], ts, self._cfdi_usado, self._cfdi_ts_sel, self._cfdi_ids,
+            fecha_inicio, fecha_fin, day_start, day_end, t_mov
+        )
+        if i < 0:
+            return None
+        return self._resultado_exacto(movimiento, int(i), "en mismo día" if mismo_dia else "±1 día")
+
+    def _resultado_exacto(self, movimiento: MovimientoBancario, i: int,
+                          etiqueta: str) -> ResultadoConciliacion:
+        """Marca como usado el CFDI en la posición `i` y arma el resultado EXACTA."""
+        elegido = self._cfdis[i]
+        self.cfdi_usados.add(elegido.id)
+        self._cfdi_usado[i] = True
+        receptor = f"; Receptor: {elegido.nombre_receptor}" if getattr(elegido, 'nombre_receptor', None) else ""
+        tipo_cfdi = f"({elegido.tipo_comprobante}-{elegido.metodo_pago})"
+
+        # Mostrar el monto correcto según el tipo
+        monto_mostrar = self._cfdi_montos[i]
+
+        return ResultadoConciliacion(
+            movimiento_id=movimiento.id,
+            cfdi_id=elegido.id,
+            tipo_conciliacion=TipoConciliacion.EXACTA,
+            razon=f"Exacta {tipo_cfdi} {etiqueta}: CFDI {elegido.uuid} - Monto: ${monto_mostrar}{receptor}",
+            fecha_conciliacion=datetime.now()
+        )
+
+    def _precargar_datos(self, movimientos: List[MovimientoBancario]) -> None:
+        """
+        Carga una sola vez los CFDIs válidos (I y P, sin PPD) del rango de fechas de los
+        movimientos ±1 día y los agrupa por monto en centavos. Para tipo P el monto es el
+        monto_pago de su complemento; sin complemento (o sin monto) el CFDI no participa.
+        """
+        self._cfdis, self._cfdi_montos = [], []
+        self._cfdi_ids = np.empty(0, dtype=np.int64)
+        self._cfdi_ts = np.empty(0, dtype=np.int64)
+        self._cfdi_ts_sel = np.empty(0, dtype=np.int64)
+        self._cfdi_usado = np.zeros(0, dtype=bool)
+        self._pos_por_monto, self._ts_por_monto = {}, {}
+        self._pos_por_dia_monto = {}
+        dias = [m.fecha.date() if hasattr(m.fecha, 'date') else m.fecha for m in movimientos if m.fecha]
+        if not dias:
+            return
+        inicio = datetime.combine(min(dias) - timedelta(days=1), datetime.min.time())
+        fin = datetime.combine(max(dias) + timedelta(days=2), datetime.min.time())
 
-        candidatos = self.db.query(ComprobanteFiscal).filter(
+        # Solo las columnas que usa la conciliación; se recorre por lotes sin armar la lista completa
+        candidatos = self.db.query(ComprobanteFiscal).options(
+            load_only(
+                ComprobanteFiscal.id, ComprobanteFiscal.tipo_comprobante, ComprobanteFiscal.metodo_pago,
+                ComprobanteFiscal.total, ComprobanteFiscal.fecha, ComprobanteFiscal.fecha_timbrado,
+                ComprobanteFiscal.uuid, ComprobanteFiscal.nombre_receptor
+            )
+        ).filter(
             and_(
                 ComprobanteFiscal.empresa_id == self.empresa_id,
-                ComprobanteFiscal.fecha.between(day_start, day_end),
+                ComprobanteFiscal.fecha.between(inicio, fin),
                 ComprobanteFiscal.estatus_sat == True
             )
-        ).all()
-        cfdis_validos = [c for c in self._filtrar_cfdis_validos(candidatos) if c.tipo_comprobante in ['I', 'P']]
-        cfdis_validos = [c for c in cfdis_validos if c.id not in self.cfdi_usados]
+        ).order_by(ComprobanteFiscal.fecha, ComprobanteFiscal.id).yield_per(1000)
 
-        # Filtrar por monto exacto (tolerancia 1 centavo)
-        # Para tipo P usar monto_pago de complementos_pago, para tipo I usar total
-        cfdis_monto = []
+        cfdis_validos = self._filtrar_cfdis_validos(candidatos)
+        self._cargar_montos_pago([c.id for c in cfdis_validos if c.tipo_comprobante == 'P'])
         for c in cfdis_validos:
             if c.tipo_comprobante == 'P':
-                # Obtener monto de complemento de pago
-                complemento = self.db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    if abs(float(complemento.monto_pago) - float(movimiento.monto)) < 0.01:
-                        cfdis_monto.append(c)
+                monto = self._montos_pago.get(c.id)
+                if not monto:
+                    continue
             else:  # tipo I
-                if abs(float(c.total) - float(movimiento.monto)) < 0.01:
-                    cfdis_monto.append(c)
-
-        if cfdis_monto:
-            elegido = self._seleccionar_cfdi_mas_cercano_por_fecha(movimiento.fecha, cfdis_monto)
-            if elegido:
-                self.cfdi_usados.add(elegido.id)
-                receptor = f"; Receptor: {elegido.nombre_receptor}" if getattr(elegido, 'nombre_receptor', None) else ""
-                tipo_cfdi = f"({elegido.tipo_comprobante}-{elegido.metodo_pago})"
-                
-                # Mostrar el monto correcto según el tipo
-                monto_mostrar = elegido.total
-                if elegido.tipo_comprobante == 'P':
-                    complemento = self.db.query(ComplementoPago).filter(
-                        ComplementoPago.cfdi_id == elegido.id
-                    ).first()
-                    if complemento and complemento.monto_pago:
-                        monto_mostrar = complemento.monto_pago
-                
-                return ResultadoConciliacion(
-                    movimiento_id=movimiento.id,
-                    cfdi_id=elegido.id,
-                    tipo_conciliacion=TipoConciliacion.EXACTA,
-                    razon=f"Exacta {tipo_cfdi} en mismo día: CFDI {elegido.uuid} - Monto: ${monto_mostrar}{receptor}",
-                    fecha_conciliacion=datetime.now()
-                )
+                if c.total is None:
+                    continue
+                monto = c.total
+            self._cfdis.append(c)
+            self._cfdi_montos.append(monto)
+            self._cfdi_por_id[c.id] = c
+        if not self._cfdis:
+            return
+
+        self._cfdi_ids = np.fromiter((c.id for c in self._cfdis), dtype=np.int64, count=len(self._cfdis))
+        cents = np.fromiter((centavos(m) for m in self._cfdi_montos), dtype=np.int64, count=len(self._cfdis))
+        ts = self._cfdi_ts = _a_us([c.fecha for c in self._cfdis])
+        self._cfdi_ts_sel = _a_us([c.fecha_timbrado or c.fecha for c in self._cfdis])
+        self._cfdi_usado = np.fromiter((c.id in self.cfdi_usados for c in self._cfdis), dtype=bool,
+                                       count=len(self._cfdis))
+        # Las filas ya vienen por (fecha, id): un argsort estable por monto deja cada monto en
+        # un tramo contiguo ordenado por fecha, listo para la búsqueda binaria
+        orden = np.argsort(cents, kind='stable')
+        for pos in np.split(orden, np.flatnonzero(np.diff(cents[orden])) + 1):
+            k = int(cents[pos[0]])
+            self._pos_por_monto[k] = pos
+            self._ts_por_monto[k] = ts[pos]
+        for i, (c, k) in enumerate(zip(self._cfdis, cents.tolist())):
+            dia = c.fecha.date() if hasattr(c.fecha, 'date') else c.fecha
+            self._pos_por_dia_monto.setdefault((dia, k), []).append(i)
+
+    def _cargar_montos_pago(self, cfdi_ids: List[int]) -> None:
+        """
+        Trae en una sola consulta el monto_pago de los complementos de los CFDIs tipo P que
+        aún no se conocen. Se queda el del primer complemento de cada CFDI (el mismo que
+        daba .first()); None si no tiene complemento.
+        """
+        faltantes = sorted({i for i in cfdi_ids if i not in self._montos_pago})
+        if not faltantes:
+            return
+        for cfdi_id in faltantes:
+            self._montos_pago[cfdi_id] = None
+        vistos = set()
+        filas = self.db.query(ComplementoPago.cfdi_id, ComplementoPago.monto_pago).filter(
+            ComplementoPago.cfdi_id.in_(faltantes)
+        ).order_by(ComplementoPago.id).all()
+        for cfdi_id, monto_pago in filas:
+            if cfdi_id not in vistos:
+                vistos.add(cfdi_id)
+                self._montos_pago[cfdi_id] = monto_pago
+
+    def _obtener_movimiento(self, movimiento_id: int) -> Optional[MovimientoBancario]:
+        """Movimiento por id: del diccionario de los ya cargados o, si no está, de la BD."""
+        movimiento = self._movimientos_por_id.get(movimiento_id)
+        if movimiento is None:
+            movimiento = self.db.query(MovimientoBancario).filter(MovimientoBancario.id == movimiento_id).first()
+            if movimiento is not None:
+                self._movimientos_por_id[movimiento_id] = movimiento
+        return movimiento
+
+    def _obtener_cfdi(self, cfdi_id: int) -> Optional[ComprobanteFiscal]:
+        """CFDI por id: del diccionario de los precargados o, si no está, de la BD."""
+        cfdi = self._cfdi_por_id.get(cfdi_id)
+        if cfdi is None:
+            cfdi = self.db.query(ComprobanteFiscal).filter(ComprobanteFiscal.id == cfdi_id).first()
+            if cfdi is not None:
+                self._cfdi_por_id[cfdi_id] = cfdi
+        return cfdi
 
-        # 2) Fallback ±1 día (estricto)
-        # Asegurar que ambas fechas sean del mismo tipo
-        if hasattr(movimiento.fecha, 'date'):  # Es datetime
-            fecha_inicio = movimiento.fecha - timedelta(days=1)
-            fecha_fin = movimiento.fecha + timedelta(days=1)
-        else:  # Es date
-            fecha_inicio = datetime.combine(movimiento.fecha - timedelta(days=1), datetime.min.time())
-            fecha_fin = datetime.combine(movimiento.fecha + timedelta(days=1), datetime.min.time())
-        candidatos2 = self.db.query(ComprobanteFiscal).filter(
-            and_(
-                ComprobanteFiscal.empresa_id == self.empresa_id,
-                ComprobanteFiscal.fecha.between(fecha_inicio, fecha_fin),
-                ComprobanteFiscal.estatus_sat == True
-            )
-        ).all()
-        cfdis_validos2 = [c for c in self._filtrar_cfdis_validos(candidatos2) if c.tipo_comprobante in ['I', 'P']]
-        cfdis_validos2 = [c for c in cfdis_validos2 if c.id not in self.cfdi_usados]
-        
-        # Filtrar por monto exacto (tolerancia 1 centavo)
-        # Para tipo P usar monto_pago de complementos_pago, para tipo I usar total
-        cfdis_monto2 = []
-        for c in cfdis_validos2:
-            if c.tipo_comprobante == 'P':
-                # Obtener monto de complemento de pago
-                complemento = self.db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    if abs(float(complemento.monto_pago) - float(movimiento.monto)) < 0.01:
-                        cfdis_monto2.append(c)
-            else:  # tipo I
-                if abs(float(c.total) - float(movimiento.monto)) < 0.01:
-                    cfdis_monto2.append(c)
-        if cfdis_monto2:
-            elegido = self._seleccionar_cfdi_mas_cercano_por_fecha(movimiento.fecha, cfdis_monto2)
-            if elegido:
-                self.cfdi_usados.add(elegido.id)
-                receptor = f"; Receptor: {elegido.nombre_receptor}" if getattr(elegido, 'nombre_receptor', None) else ""
-                tipo_cfdi = f"({elegido.tipo_comprobante}-{elegido.metodo_pago})"
-                
-                # Mostrar el monto correcto según el tipo
-                monto_mostrar = elegido.total
-                if elegido.tipo_comprobante == 'P':
-                    complemento = self.db.query(ComplementoPago).filter(
-                        ComplementoPago.cfdi_id == elegido.id
-                    ).first()
-                    if complemento and complemento.monto_pago:
-                        monto_mostrar = complemento.monto_pago
-                
-                return ResultadoConciliacion(
-                    movimiento_id=movimiento.id,
-                    cfdi_id=elegido.id,
-                    tipo_conciliacion=TipoConciliacion.EXACTA,
-                    razon=f"Exacta {tipo_cfdi} ±1 día: CFDI {elegido.uuid} - Monto: ${monto_mostrar}{receptor}",
-                    fecha_conciliacion=datetime.now()
-                )
-        
-        return None
-    
     def _filtrar_cfdis_validos(self, cfdis: List[ComprobanteFiscal]) -> List[ComprobanteFiscal]:
         """
         Filtra CFDIs válidos para conciliación:
@@ -264,25 +380,23 @@ class ConciliadorMejorado:
         Genera reporte de conciliación
         """
         total_movimientos = len(resultados)
-        exactos = len([r for r in resultados if r.tipo_conciliacion == TipoConciliacion.EXACTA])
-        pendientes = len([r for r in resultados if r.tipo_conciliacion == TipoConciliacion.PENDIENTE])
-        duplicados = len([r for r in resultados if r.tipo_conciliacion == TipoConciliacion.REVISION_DUPLICADOS])
+        # Un solo recorrido para los tres conteos
+        por_tipo = Counter(r.tipo_conciliacion for r in resultados)
+        exactos = por_tipo[TipoConciliacion.EXACTA]
+        pendientes = por_tipo[TipoConciliacion.PENDIENTE]
+        duplicados = por_tipo[TipoConciliacion.REVISION_DUPLICADOS]
         
         detalles = []
         for r in resultados:
             # Obtener datos del movimiento
-            movimiento = self.db.query(MovimientoBancario).filter(
-                MovimientoBancario.id == r.movimiento_id
-            ).first()
+            movimiento = self._obtener_movimiento(r.movimiento_id)
             
             # Obtener datos del CFDI si existe
             cfdi_monto = None
             cfdi_total = None
             cfdi_receptor = None
             if r.cfdi_id:
-                cfdi = self.db.query(ComprobanteFiscal).filter(
-                    ComprobanteFiscal.id == r.cfdi_id
-                ).first()
+                cfdi = self._obtener_cfdi(r.cfdi_id)
                 if cfdi:
                     cfdi_monto = cfdi.total
                     cfdi_total = cfdi.total
@@ -344,9 +458,7 @@ class ConciliadorMejorado:
         movimientos_por_fecha_monto = {}
         
         for resultado in resultados:
-            movimiento = self.db.query(MovimientoBancario).filter(
-                MovimientoBancario.id == resultado.movimiento_id
-            ).first()
+            movimiento = self._obtener_movimiento(resultado.movimiento_id)
             
             if movimiento:
                 # Crear clave única: (fecha_exacta, monto) - solo mismo día exacto
@@ -354,16 +466,21 @@ class ConciliadorMejorado:
                     fecha_exacta = movimiento.fecha.date()
                 else:
                     fecha_exacta = movimiento.fecha
-                monto = float(movimiento.monto)
-                clave = (fecha_exacta, monto)
+                clave = (fecha_exacta, centavos(movimiento.monto))
                 
                 if clave not in movimientos_por_fecha_monto:
                     movimientos_por_fecha_monto[clave] = []
                 movimientos_por_fecha_monto[clave].append(resultado.movimiento_id)
         
+        # Resultado de cada movimiento (el primero si se repite), para marcarlo sin recorrer la lista
+        resultado_por_movimiento = {}
+        for resultado in resultados:
+            resultado_por_movimiento.setdefault(resultado.movimiento_id, resultado)
+
         # Marcar como revisión los grupos con más de 1 movimiento
-        for (fecha_exacta, monto), mov_ids in movimientos_por_fecha_monto.items():
+        for (fecha_exacta, monto_cents), mov_ids in movimientos_por_fecha_monto.items():
             if len(mov_ids) > 1:
+                monto = monto_cents / 100
                 fecha_str = fecha_exacta.strftime("%Y-%m-%d") if hasattr(fecha_exacta, 'strftime') else str(fecha_exacta)
                 logger.info(f"🔍 Detectados {len(mov_ids)} movimientos duplicados: fecha {fecha_str}, monto ${monto}")
                 
@@ -372,11 +489,9 @@ class ConciliadorMejorado:
                 
                 # Marcar TODOS como revisión requerida cuando hay duplicados (mismo día, mismo monto)
                 for mov_id in mov_ids_ordenados:
-                    for resultado in resultados:
-                        if resultado.movimiento_id == mov_id:
-                            resultado.tipo_conciliacion = TipoConciliacion.REVISION_DUPLICADOS
-                            resultado.razon = f"REVISIÓN REQUERIDA: {len(mov_ids)} movimientos con mismo monto ${monto} en {fecha_str}. Grupo: {', '.join(map(str, mov_ids_ordenados))}"
-                            break
+                    resultado = resultado_por_movimiento[mov_id]
+                    resultado.tipo_conciliacion = TipoConciliacion.REVISION_DUPLICADOS
+                    resultado.razon = f"REVISIÓN REQUERIDA: {len(mov_ids)} movimientos con mismo monto ${monto} en {fecha_str}. Grupo: {', '.join(map(str, mov_ids_ordenados))}"
 
     def _marcar_cfdi_no_unico_por_dia(self, resultados: List[ResultadoConciliacion]) -> None:
         """
@@ -384,13 +499,16 @@ class ConciliadorMejorado:
         La lógica es: 1 movimiento + 1 CFDI del mismo monto en la misma fecha = EXACTA
         Múltiples movimientos o múltiples CFDIs del mismo monto en la misma fecha = REVISIÓN
         """
-        if not resultados:
+        # Sólo las EXACTA con CFDI pueden pasar a revisión: se separan una vez y, si no queda
+        # ninguna, no hace falta contar nada
+        exactas = [r for r in resultados if r.tipo_conciliacion == TipoConciliacion.EXACTA and r.cfdi_id]
+        if not exactas:
             return
 
         # Recolectar rango de fechas de movimientos para acotar consulta
         dias_movimientos = []
         for r in resultados:
-            mov = self.db.query(MovimientoBancario).filter(MovimientoBancario.id == r.movimiento_id).first()
+            mov = self._obtener_movimiento(r.movimiento_id)
             if not mov or not mov.fecha:
                 continue
             dia = mov.fecha.date() if hasattr(mov.fecha, 'date') else mov.fecha
@@ -403,77 +521,39 @@ class ConciliadorMejorado:
         inicio = datetime.combine(min_dia, datetime.min.time())
         fin = datetime.combine(max_dia, datetime.max.time())
 
-        # Obtener CFDIs del rango
-        cfdi_query = self.db.query(ComprobanteFiscal).filter(
-            and_(
-                ComprobanteFiscal.empresa_id == self.empresa_id,
-                ComprobanteFiscal.estatus_sat == True,
-                ComprobanteFiscal.fecha.between(inicio, fin)
-            )
-        )
-        cfdi_query = cfdi_query.filter(
-            and_(
-                ComprobanteFiscal.tipo_comprobante.in_(['I', 'P']),
-                or_(
-                    ComprobanteFiscal.metodo_pago != 'PPD',
-                    ComprobanteFiscal.metodo_pago.is_(None)
-                )
-            )
-        )
-        cfdis_rango = cfdi_query.all()
-
-        # Obtener movimientos del rango
-        movimientos_query = self.db.query(MovimientoBancario).filter(
+        # Movimientos del rango ya agregados por (fecha, monto) en la BD: no se hidratan objetos
+        # y la memoria queda acotada por las combinaciones distintas, no por las filas
+        movimientos_query = self.db.query(
+            MovimientoBancario.fecha, MovimientoBancario.monto, func.count(MovimientoBancario.id)
+        ).filter(
             and_(
                 MovimientoBancario.empresa_id == self.empresa_id,
                 MovimientoBancario.fecha.between(inicio, fin)
             )
-        )
+        ).group_by(MovimientoBancario.fecha, MovimientoBancario.monto)
         movimientos_rango = movimientos_query.all()
 
-        # Conteo de CFDIs por (día, monto)
-        conteo_cfdis_por_dia_monto = {}
-        for c in cfdis_rango:
-            f = getattr(c, 'fecha', None) or getattr(c, 'fecha_timbrado', None)
-            if not f:
-                continue
-            dia_c = f.date() if hasattr(f, 'date') else f
-            
-            # Para tipo P usar monto_pago, para tipo I usar total
-            if c.tipo_comprobante == 'P':
-                complemento = self.db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    monto_c = round(float(complemento.monto_pago), 2)
-                else:
-                    continue
-            else:
-                monto_c = round(float(c.total), 2) if getattr(c, 'total', None) is not None else None
-                if monto_c is None:
-                    continue
-            
-            clave = (dia_c, monto_c)
-            conteo_cfdis_por_dia_monto[clave] = conteo_cfdis_por_dia_monto.get(clave, 0) + 1
+        # Conteo de CFDIs por (día, monto): sale del índice de los precargados, cuya ventana
+        # (±1 día) contiene a [min_dia, max_dia]; fuera de ese rango el conteo es 0
+        def contar_cfdis(clave) -> int:
+            if not (min_dia <= clave[0] <= max_dia):
+                return 0
+            return len(self._pos_por_dia_monto.get(clave, ()))
 
         # Conteo de movimientos por (día, monto)
         conteo_movs_por_dia_monto = {}
-        for m in movimientos_rango:
-            if not m.fecha or not m.monto:
+        for fecha_m, monto_m, n in movimientos_rango:
+            if not fecha_m or not monto_m:
                 continue
-            dia_m = m.fecha.date() if hasattr(m.fecha, 'date') else m.fecha
-            monto_m = round(float(m.monto), 2)
-            clave = (dia_m, monto_m)
-            conteo_movs_por_dia_monto[clave] = conteo_movs_por_dia_monto.get(clave, 0) + 1
+            dia_m = fecha_m.date() if hasattr(fecha_m, 'date') else fecha_m
+            clave = (dia_m, centavos(monto_m))
+            conteo_movs_por_dia_monto[clave] = conteo_movs_por_dia_monto.get(clave, 0) + n
 
         # Marcar resultados según la lógica de unicidad
-        for r in resultados:
-            if r.tipo_conciliacion != TipoConciliacion.EXACTA or not r.cfdi_id:
-                continue
-            
+        for r in exactas:
             # Obtener datos del movimiento y CFDI
-            mov = self.db.query(MovimientoBancario).filter(MovimientoBancario.id == r.movimiento_id).first()
-            cfdi = self.db.query(ComprobanteFiscal).filter(ComprobanteFiscal.id == r.cfdi_id).first()
+            mov = self._obtener_movimiento(r.movimiento_id)
+            cfdi = self._obtener_cfdi(r.cfdi_id)
             if not mov or not cfdi:
                 continue
             
@@ -489,11 +569,10 @@ class ConciliadorMejorado:
             
             # Para tipo P usar monto_pago, para tipo I usar total
             if cfdi.tipo_comprobante == 'P':
-                complemento = self.db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == cfdi.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    monto_cfdi = round(float(complemento.monto_pago), 2)
+                self._cargar_montos_pago([cfdi.id])
+                monto_pago = self._montos_pago.get(cfdi.id)
+                if monto_pago:
+                    monto_cfdi = round(float(monto_pago), 2)
                 else:
                     continue
             else:
@@ -502,11 +581,11 @@ class ConciliadorMejorado:
                     continue
             
             # Verificar unicidad
-            clave_mov = (dia_mov, monto_mov)
-            clave_cfdi = (dia_cfdi, monto_cfdi)
+            clave_mov = (dia_mov, centavos(monto_mov))
+            clave_cfdi = (dia_cfdi, centavos(monto_cfdi))
             
             count_movs = conteo_movs_por_dia_monto.get(clave_mov, 0)
-            count_cfdis = conteo_cfdis_por_dia_monto.get(clave_cfdi, 0)
+            count_cfdis = contar_cfdis(clave_cfdi)
             
             # Si hay múltiples movimientos o múltiples CFDIs del mismo monto en la misma fecha, marcar como revisión
             if count_movs > 1 or count_cfdis > 1:
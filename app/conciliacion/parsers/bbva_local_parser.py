@@ -11,6 +11,22 @@ import fitz  # PyMuPDF
 
 logger = logging.getLogger(__name__)
 
+# Patrones por línea compilados una sola vez para todo el módulo
+PAT_OPER_CODE = re.compile(r"\b(T\d{2}|N\d{2}|AA\d|C\d{2})\b")
+PAT_BNET = re.compile(r"\bBNET\s+\d+\b")
+
+# Marcadores de resumen/legales que cierran un bloque de movimiento (en mayúsculas)
+STOP_MARKERS = (
+    'TOTAL DE MOVIMIENTOS', 'TOTAL IMPORTE CARGOS', 'TOTAL IMPORTE ABONOS',
+    'BBVA MEXICO', 'ESTADO DE CUENTA', 'PAGINA', 'GLOSARIO DE ABREVIATURAS',
+    'REGIMEN FISCAL', 'RÉGIMEN FISCAL', 'FOLIO FISCAL', 'CERTIFICADO', 'SELLO SAT',
+    'CADENA ORIGINAL', 'UNIDAD ESPECIALIZADA', 'POR DISPOSICION OFICIAL',
+    'POR DISPOSICIÓN OFICIAL', 'NO. CUENTA', 'NO. CLIENTE', 'CUADRO RESUMEN',
+    'GRAFICO DE MOVIMIENTOS', 'GRÁFICO DE MOVIMIENTOS'
+)
+# Una sola pasada por línea en vez de un `in` por marcador
+PAT_STOP_MARKERS = re.compile("|".join(map(re.escape, STOP_MARKERS)))
+
 class BBVALocalParser:
     """Parser local para documentos BBVA grandes sin usar IA."""
     
@@ -82,16 +98,6 @@ class BBVALocalParser:
                         continue
                     fecha = m.group(1)
                     
-                    # Texto completo del bloque (para detectar códigos como T20, T17, N06, AA7, C02)
-                    bloque_texto_upper = (" ".join(blk)).upper()
-                    op_code = None
-                    try:
-                        mcode = re.search(r"\b(T\d{2}|N\d{2}|AA\d|C\d{2})\b", bloque_texto_upper)
-                        if mcode:
-                            op_code = mcode.group(1)
-                    except Exception:
-                        op_code = None
-                    
                     # Variables para el procesamiento del bloque
                     concepto_lines: list[str] = []
                     referencia = None
@@ -99,15 +105,6 @@ class BBVALocalParser:
                     saldo_movimiento: Optional[float] = None
                     oper_code = None  # Para capturar códigos como T20, N06, etc.
                     
-                    stop_markers = [
-                        'TOTAL DE MOVIMIENTOS', 'TOTAL IMPORTE CARGOS', 'TOTAL IMPORTE ABONOS',
-                        'BBVA MEXICO', 'ESTADO DE CUENTA', 'PAGINA', 'GLOSARIO DE ABREVIATURAS',
-                        'REGIMEN FISCAL', 'RÉGIMEN FISCAL', 'FOLIO FISCAL', 'CERTIFICADO', 'SELLO SAT',
-                        'CADENA ORIGINAL', 'UNIDAD ESPECIALIZADA', 'POR DISPOSICION OFICIAL',
-                        'POR DISPOSICIÓN OFICIAL', 'NO. CUENTA', 'NO. CLIENTE', 'CUADRO RESUMEN',
-                        'GRAFICO DE MOVIMIENTOS', 'GRÁFICO DE MOVIMIENTOS'
-                    ]
-                    
                     for ln in blk[1:]:
                         refm = pat_ref.search(ln)
                         if refm:
@@ -118,12 +115,12 @@ class BBVALocalParser:
                         up_ln = ln.upper()
                         
                         # Si encontramos marcadores de resumen/legales, cortamos el bloque aquí
-                        if any(marker in up_ln for marker in stop_markers):
+                        if PAT_STOP_MARKERS.search(up_ln):
                             break
                         
                         # Capturar código de operación (T20, N06, etc.) de la primera línea
                         if oper_code is None:
-                            oper_match = re.search(r"\b(T\d{2}|N\d{2}|AA\d|C\d{2})\b", ln)
+                            oper_match = PAT_OPER_CODE.search(ln)
                             if oper_match:
                                 oper_code = oper_match.group(1)
                         
@@ -156,9 +153,9 @@ class BBVALocalParser:
                             # Limpiar la línea antes de agregarla al concepto
                             clean_concept_line = ln.strip()
                             # Remover códigos de operación del concepto
-                            clean_concept_line = re.sub(r"\b(T\d{2}|N\d{2}|AA\d|C\d{2})\b", "", clean_concept_line)
+                            clean_concept_line = PAT_OPER_CODE.sub("", clean_concept_line)
                             # Remover códigos BNET
-                            clean_concept_line = re.sub(r"\bBNET\s+\d+\b", "", clean_concept_line)
+                            clean_concept_line = PAT_BNET.sub("", clean_concept_line)
                             # Limpiar espacios extra
                             clean_concept_line = " ".join(clean_concept_line.split())
                             if clean_concept_line:
@@ -169,7 +166,7 @@ class BBVALocalParser:
                     
                     # Recorte defensivo del concepto ante marcadores si se colaron
                     concepto_up = concepto.upper()
-                    for marker in stop_markers:
+                    for marker in STOP_MARKERS:
                         idx = concepto_up.find(marker)
                         if idx != -1:
                             concepto = concepto[:idx].strip()
@@ -8,7 +8,7 @@ from datetime import datetime, timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func
 
 from app.core.database import get_db
 from app.conciliacion.models import MovimientoBancario, EstadoConciliacion
@@ -100,23 +100,33 @@ async def ejecutar_conciliacion_mejorada(
         resultados = conciliador.conciliar_movimientos(movimientos)
         reporte = conciliador.generar_reporte(resultados)
         
-        # Actualizar estado de movimientos en BD
+        # Actualizar estado de movimientos en BD: un solo UPDATE masivo por lotes, sin pasar
+        # cada fila por el unit of work del ORM
+        movimientos_por_id = {m.id: m for m in movimientos}
+        cfdi_ids = {r.cfdi_id for r in resultados if r.tipo_conciliacion == TipoConciliacion.EXACTA and r.cfdi_id}
+        uuid_por_cfdi = dict(
+            db.query(ComprobanteFiscal.id, ComprobanteFiscal.uuid).filter(ComprobanteFiscal.id.in_(cfdi_ids)).all()
+        ) if cfdi_ids else {}
+        actualizaciones = []
         for resultado in resultados:
-            movimiento = db.query(MovimientoBancario).filter(
-                MovimientoBancario.id == resultado.movimiento_id
-            ).first()
-            
-            if movimiento:
-                if resultado.tipo_conciliacion == TipoConciliacion.EXACTA:
-                    # Mapear resultado a cfdi_uuid y actualizar estado/fecha
-                    cfdi = db.query(ComprobanteFiscal).filter(ComprobanteFiscal.id == resultado.cfdi_id).first() if resultado.cfdi_id else None
-                    if cfdi and cfdi.uuid:
-                        movimiento.cfdi_uuid = cfdi.uuid
-                    movimiento.estado = EstadoConciliacion.CONCILIADO
-                    movimiento.fecha_conciliacion = datetime.now()
-                else:
-                    movimiento.estado = EstadoConciliacion.PENDIENTE
-        
+            if resultado.movimiento_id not in movimientos_por_id:
+                continue
+            if resultado.tipo_conciliacion == TipoConciliacion.EXACTA:
+                # Mapear resultado a cfdi_uuid y actualizar estado/fecha
+                cambios = {
+                    "id": resultado.movimiento_id,
+                    "estado": EstadoConciliacion.CONCILIADO,
+                    "fecha_conciliacion": datetime.now()
+                }
+                cfdi_uuid = uuid_por_cfdi.get(resultado.cfdi_id)
+                if cfdi_uuid:
+                    cambios["cfdi_uuid"] = cfdi_uuid
+            else:
+                cambios = {"id": resultado.movimiento_id, "estado": EstadoConciliacion.PENDIENTE}
+            actualizaciones.append(cambios)
+
+        if actualizaciones:
+            db.bulk_update_mappings(MovimientoBancario, actualizaciones)
         db.commit()
         
         logger.info(f"✅ Conciliación completada: {reporte['resumen']['conciliados_exactos']} exactos, {reporte['resumen']['pendientes_revision']} pendientes")
@@ -149,8 +159,8 @@ async def obtener_reporte_conciliacion(
     Obtiene reporte de conciliación por empresa
     """
     try:
-        # Construir query base
-        query = db.query(MovimientoBancario).filter(
+        # Construir query base: el conteo por estado lo hace la BD (GROUP BY), sin materializar filas
+        query = db.query(MovimientoBancario.estado, func.count(MovimientoBancario.id)).filter(
             MovimientoBancario.empresa_id == empresa_id
         )
         
@@ -163,17 +173,17 @@ async def obtener_reporte_conciliacion(
             fecha_fin_d = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
             query = query.filter(MovimientoBancario.fecha <= fecha_fin_d)
         
-        movimientos = query.all()
-        
         # Contar por estado
         estados = {}
-        for movimiento in movimientos:
-            estado = movimiento.estado.value if movimiento.estado else "PENDIENTE"
-            estados[estado] = estados.get(estado, 0) + 1
+        total_movimientos = 0
+        for estado_mov, n in query.group_by(MovimientoBancario.estado).all():
+            estado = estado_mov.value if estado_mov else "PENDIENTE"
+            estados[estado] = estados.get(estado, 0) + n
+            total_movimientos += n
         
         return {
             "empresa_id": empresa_id,
-            "total_movimientos": len(movimientos),
+            "total_movimientos": total_movimientos,
             "estados": estados,
             "fecha_reporte": datetime.now().isoformat()
         }
@@ -311,16 +321,31 @@ async def obtener_montos_por_rango(
         fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d").date() if fecha_inicio else None
         fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d").date() if fecha_fin else None
 
-        # Movimientos
-        q_mov = db.query(MovimientoBancario).filter(MovimientoBancario.empresa_id == empresa_id)
+        # Agregar por monto (redondeo a 2 decimales)
+        def to_amount_key(x: float) -> float:
+            try:
+                return round(float(x), 2)
+            except Exception:
+                return None
+
+        # Movimientos: el conteo por monto lo hace la BD (GROUP BY), sin materializar filas
+        q_mov = db.query(MovimientoBancario.monto, func.count(MovimientoBancario.id)).filter(
+            MovimientoBancario.empresa_id == empresa_id
+        )
         if fecha_inicio_dt:
             q_mov = q_mov.filter(MovimientoBancario.fecha >= fecha_inicio_dt)
         if fecha_fin_dt:
             q_mov = q_mov.filter(MovimientoBancario.fecha <= fecha_fin_dt)
-        movimientos = q_mov.all()
+
+        mov_by_amount: Dict[float, int] = {}
+        for monto_mov, n in q_mov.group_by(MovimientoBancario.monto).all():
+            k = to_amount_key(monto_mov)
+            if k is None:
+                continue
+            mov_by_amount[k] = mov_by_amount.get(k, 0) + n
 
         # CFDIs - Siempre permitir tanto PUE como P, excluyendo PPD (permitir NULL en metodo para tipo P)
-        q_cfdi = db.query(ComprobanteFiscal).filter(
+        q_cfdi = db.query(ComprobanteFiscal.id, ComprobanteFiscal.tipo_comprobante, ComprobanteFiscal.total).filter(
             ComprobanteFiscal.empresa_id == empresa_id,
             ComprobanteFiscal.estatus_sat == True
         )
@@ -350,29 +375,22 @@ async def obtener_montos_por_rango(
         )
         cfdis = q_cfdi.all()
 
-        # Agregar por monto (redondeo a 2 decimales)
-        def to_amount_key(x: float) -> float:
-            try:
-                return round(float(x), 2)
-            except Exception:
-                return None
-
-        mov_by_amount: Dict[float, int] = {}
-        for m in movimientos:
-            k = to_amount_key(m.monto)
-            if k is None:
-                continue
-            mov_by_amount[k] = mov_by_amount.get(k, 0) + 1
+        # Para tipo P usar monto_pago de su (primer) complemento: una sola consulta para todos
+        ids_pago = [c.id for c in cfdis if c.tipo_comprobante == 'P']
+        monto_pago_por_cfdi: Dict[int, object] = {}
+        if ids_pago:
+            for cfdi_id, monto_pago in db.query(ComplementoPago.cfdi_id, ComplementoPago.monto_pago).filter(
+                ComplementoPago.cfdi_id.in_(ids_pago)
+            ).order_by(ComplementoPago.id).all():
+                monto_pago_por_cfdi.setdefault(cfdi_id, monto_pago)
 
         cfdi_by_amount: Dict[float, int] = {}
         for c in cfdis:
             # Para tipo P usar monto_pago de complementos_pago, para tipo I usar total
             if c.tipo_comprobante == 'P':
-                complemento = db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    k = to_amount_key(complemento.monto_pago)
+                monto_pago = monto_pago_por_cfdi.get(c.id)
+                if monto_pago:
+                    k = to_amount_key(monto_pago)
                     if k is not None:
                         cfdi_by_amount[k] = cfdi_by_amount.get(k, 0) + 1
             else:  # tipo I
@@ -440,14 +458,21 @@ async def obtener_detalle_monto(
         fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d").date() if fecha_inicio else None
         fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d").date() if fecha_fin else None
 
+        tol = 0.01  # Tolerancia fija de 0.01 para agrupar montos cercanos
+        # Rango de monto para que la BD descarte de entrada lo que no puede coincidir; un poco
+        # más ancho que la tolerancia, la comparación exacta se sigue haciendo abajo
+        monto_min, monto_max = float(monto) - 2 * tol, float(monto) + 2 * tol
+
         # Movimientos
-        q_mov = db.query(MovimientoBancario).filter(MovimientoBancario.empresa_id == empresa_id)
+        q_mov = db.query(MovimientoBancario).filter(
+            MovimientoBancario.empresa_id == empresa_id,
+            MovimientoBancario.monto.between(monto_min, monto_max)
+        )
         if fecha_inicio_dt:
             q_mov = q_mov.filter(MovimientoBancario.fecha >= fecha_inicio_dt)
         if fecha_fin_dt:
             q_mov = q_mov.filter(MovimientoBancario.fecha <= fecha_fin_dt)
         movs_all = q_mov.all()
-        tol = 0.01  # Tolerancia fija de 0.01 para agrupar montos cercanos
         movimientos = [
             m for m in movs_all
             if (m.monto is not None and abs(float(m.monto) - float(monto)) <= tol)
@@ -482,16 +507,32 @@ async def obtener_detalle_monto(
                 )
             )
         )
+        # Tipo I: el total ya acota el rango; tipo P se decide por el monto_pago del complemento
+        q_cfdi = q_cfdi.filter(
+            or_(
+                ComprobanteFiscal.tipo_comprobante == 'P',
+                ComprobanteFiscal.total.between(monto_min, monto_max)
+            )
+        )
         cfdis_all = q_cfdi.all()
+
+        # monto_pago del (primer) complemento de cada CFDI tipo P: se consulta una vez y se
+        # reutiliza tanto al filtrar por monto como al armar la respuesta
+        ids_pago = [c.id for c in cfdis_all if c.tipo_comprobante == 'P']
+        monto_pago_por_cfdi: Dict[int, object] = {}
+        if ids_pago:
+            for cfdi_id, monto_pago in db.query(ComplementoPago.cfdi_id, ComplementoPago.monto_pago).filter(
+                ComplementoPago.cfdi_id.in_(ids_pago)
+            ).order_by(ComplementoPago.id).all():
+                monto_pago_por_cfdi.setdefault(cfdi_id, monto_pago)
+
         cfdis = []
         for c in cfdis_all:
             # Para tipo P usar monto_pago de complementos_pago, para tipo I usar total
             if c.tipo_comprobante == 'P':
-                complemento = db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    if abs(float(complemento.monto_pago) - float(monto)) <= tol:
+                monto_pago = monto_pago_por_cfdi.get(c.id)
+                if monto_pago:
+                    if abs(float(monto_pago) - float(monto)) <= tol:
                         cfdis.append(c)
             else:  # tipo I
                 if c.total is not None and abs(float(c.total) - float(monto)) <= tol:
@@ -516,10 +557,12 @@ async def obtener_detalle_monto(
             f = c.fecha or c.fecha_timbrado
             return normalizar_fecha(f)
 
+        # Fecha normalizada de cada CFDI, calculada una vez para el conteo y la respuesta
+        fecha_por_cfdi = {c.id: obtener_fecha_cfdi(c) for c in cfdis}
+
         cfdis_por_fecha = defaultdict(int)
         for c in cfdis:
-            f = obtener_fecha_cfdi(c)
-            cfdis_por_fecha[f] += 1
+            cfdis_por_fecha[fecha_por_cfdi[c.id]] += 1
 
         movimientos_out = []
         for m in sorted(movimientos, key=lambda x: (x.fecha, x.id)):
@@ -561,7 +604,7 @@ async def obtener_detalle_monto(
         cfdis_egreso = []
         
         for c in sorted(cfdis, key=lambda x: ((x.fecha or x.fecha_timbrado), (x.uuid or ""))):
-            f = obtener_fecha_cfdi(c)
+            f = fecha_por_cfdi[c.id]
             es_unico_cfdi_dia = cfdis_por_fecha.get(f, 0) == 1
             es_unico_mov_dia = movs_por_fecha.get(f, 0) == 1
             valido = es_unico_cfdi_dia and es_unico_mov_dia
@@ -573,11 +616,9 @@ async def obtener_detalle_monto(
             # Obtener monto de complemento de pago si es tipo P
             monto_pago = None
             if c.tipo_comprobante == 'P':
-                complemento = db.query(ComplementoPago).filter(
-                    ComplementoPago.cfdi_id == c.id
-                ).first()
-                if complemento and complemento.monto_pago:
-                    monto_pago = float(complemento.monto_pago)
+                monto_pago_c = monto_pago_por_cfdi.get(c.id)
+                if monto_pago_c:
+                    monto_pago = float(monto_pago_c)
                     logger.info(f"✅ CFDI P {c.uuid}: monto_pago={monto_pago}")
                 else:
                     logger.warning(f"⚠️ CFDI P {c.uuid}: sin complemento o monto_pago")
@@ -9,6 +9,7 @@ try:
 except ImportError:
     MATPLOTLIB_AVAILABLE = False
 from pathlib import Path
+from functools import lru_cache
 import unicodedata
 from statistics import median
 import pandas as pd
@@ -88,10 +89,12 @@ def in_band_center(bb, xs, xe):
     xc = x_center(bb)
     return xs <= xc < xe
 
+@lru_cache(maxsize=8192)
 def normalize_text(s: str) -> str:
     if not isinstance(s, str):
         return ""
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    if not s.isascii():  # ASCII no tiene acentos: se omite la descomposición NFD
+        s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
     return s.upper().strip()
 
 def is_all_caps_raw(s: str) -> bool:
@@ -133,9 +136,11 @@ MESES = {"ENE":"ENE","FEB":"FEB","MAR":"MAR","ABR":"ABR","MAY":"MAY","JUN":"JUN"
 # Fechas embebidas en descripción tipo "15-ENE-23" o "15/ENE/23"
 RX_FECHA_DMY_IN_DESC = re.compile(r"\b([0-3]?\d)[-/](ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[-/](\d{2,4})\b", re.I)
 
+_FECHA_TRANS = str.maketrans({".": " ", "-": " ", "/": " "})
+
+@lru_cache(maxsize=8192)
 def normalize_fecha(raw: str) -> str:
-    s = normalize_text(raw).replace(".", " ").replace("-", " ").replace("/", " ")
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = " ".join(normalize_text(raw).translate(_FECHA_TRANS).split())
     m = RX_FECHA_MES.search(s) or RX_FECHA_NUM.search(s)
     if not m:
         return raw.strip()
@@ -11,10 +11,26 @@ from app.conciliacion.models import ArchivoBancario, TipoBanco, MovimientoBancar
 from app.conciliacion.gemini_processor import GeminiProcessor
 from app.core.database import get_db
 from app.models.mysql_models import EmpresaContribuyente
+from app.utils.montos import centavos
 
 logger = logging.getLogger(__name__)
 
 
+# Mapeo de meses en español
+_MESES_ES = {
+    'ENE': '01', 'FEB': '02', 'MAR': '03', 'ABR': '04', 'MAY': '05', 'JUN': '06',
+    'JUL': '07', 'AGO': '08', 'SEP': '09', 'OCT': '10', 'NOV': '11', 'DIC': '12',
+    'ENERO': '01', 'FEBRERO': '02', 'MARZO': '03', 'ABRIL': '04', 'MAYO': '05', 'JUNIO': '06',
+    'JULIO': '07', 'AGOSTO': '08', 'SEPTIEMBRE': '09', 'OCTUBRE': '10', 'NOVIEMBRE': '11', 'DICIEMBRE': '12'
+}
+
+# Formatos estándar
+_FORMATOS_FECHA = (
+    '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y',
+    '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y'
+)
+
+
 class ArchivoBancarioService:
     #Servicio para gestión completa de archivos bancarios
     
@@ -251,19 +267,20 @@ class ArchivoBancarioService:
     def _calcular_saldos_por_movimientos(self, archivo_bancario: ArchivoBancario, movimientos: List[Dict[str, Any]]) -> None:
         #Calcula saldos basándose en los movimientos si no están disponibles
         try:
-            saldo_actual = 0.0
+            # Se acumula en centavos enteros y sólo al final se vuelve a pesos
+            saldo_actual = 0
             
             for mov in movimientos:
                 cargos = mov.get('cargos', 0) or 0
                 abonos = mov.get('abonos', 0) or 0
                 
                 # Calcular saldo después del movimiento
-                saldo_actual += abonos - cargos
+                saldo_actual += centavos(abonos) - centavos(cargos)
                 
                 # Si el movimiento tiene saldo explícito, usarlo
                 saldo_mov = mov.get('saldo')
                 if saldo_mov is not None and saldo_mov != 0:
-                    saldo_actual = saldo_mov
+                    saldo_actual = centavos(saldo_mov)
             
             # Si calculamos saldos, usar el primer movimiento como inicial
             if movimientos:
@@ -271,8 +288,8 @@ class ArchivoBancarioService:
                 cargos_inicial = primer_mov.get('cargos', 0) or 0
                 abonos_inicial = primer_mov.get('abonos', 0) or 0
                 
-                archivo_bancario.saldo_inicial = saldo_actual - abonos_inicial + cargos_inicial
-                archivo_bancario.saldo_final = saldo_actual
+                archivo_bancario.saldo_inicial = (saldo_actual - centavos(abonos_inicial) + centavos(cargos_inicial)) / 100
+                archivo_bancario.saldo_final = saldo_actual / 100
                 
                 logger.info(f"💰 Saldos calculados: Inicial=${archivo_bancario.saldo_inicial}, Final=${archivo_bancario.saldo_final}")
                 
@@ -287,6 +304,10 @@ class ArchivoBancarioService:
             
             logger.info(f"📊 Iniciando guardado de {len(movimientos)} movimientos en BD")
             
+            # Un estado de cuenta repite la misma fecha en muchos movimientos: cada texto se
+            # parsea una sola vez (los formatos que no aplican cuestan una excepción cada uno)
+            fechas_parseadas: Dict[str, Optional[datetime]] = {}
+            
             for i, mov in enumerate(movimientos):
                 try:
                     # Parsear fecha usando función robusta
@@ -298,11 +319,14 @@ class ArchivoBancarioService:
                         continue
                     
                     # Usar función robusta para parsear fecha
-                    fecha = self._parsear_fecha_robusta(fecha_str)
+                    fecha_nueva = fecha_str not in fechas_parseadas
+                    if fecha_nueva:
+                        fechas_parseadas[fecha_str] = self._parsear_fecha_robusta(fecha_str)
+                    fecha = fechas_parseadas[fecha_str]
                     
                     if not fecha:
                         movimientos_omitidos += 1
-                        if movimientos_omitidos <= 3:  # Solo mostrar los primeros 3
+                        if fecha_nueva:  # un aviso por texto de fecha, no por cada fila que lo repite
                             logger.warning(f"⚠️ Movimiento {i+1}: No se pudo parsear fecha '{fecha_str}', usando fecha actual")
                         fecha = datetime.now()
                     
@@ -373,13 +397,9 @@ class ArchivoBancarioService:
                         logger.error(f"❌ Error guardando movimiento {i+1} (y otros {movimientos_omitidos-3} más)")
                     continue
             
-            # Commit de todos los movimientos
-            self.db.commit()
-            logger.info(f"✅ Guardados {movimientos_guardados} movimientos en BD")
-            logger.info(f"📊 Resumen: {movimientos_guardados} guardados, {movimientos_omitidos} omitidos de {len(movimientos)} totales")
-            
-            # Commit de todos los movimientos
-            self.db.commit()
+            # Envío los INSERT (flush) sin cerrar la transacción: el commit único lo hace
+            # _actualizar_archivo_con_resultados junto con los datos del archivo
+            self.db.flush()
             logger.info(f"✅ Guardados {movimientos_guardados} movimientos en BD")
             logger.info(f"📊 Resumen: {movimientos_guardados} guardados, {movimientos_omitidos} omitidos de {len(movimientos)} totales")
             return movimientos_guardados
@@ -399,19 +419,8 @@ class ArchivoBancarioService:
         
         fecha_str = fecha_str.strip()
         
-        # Mapeo de meses en español
-        meses_es = {
-            'ENE': '01', 'FEB': '02', 'MAR': '03', 'ABR': '04', 'MAY': '05', 'JUN': '06',
-            'JUL': '07', 'AGO': '08', 'SEP': '09', 'OCT': '10', 'NOV': '11', 'DIC': '12',
-            'ENERO': '01', 'FEBRERO': '02', 'MARZO': '03', 'ABRIL': '04', 'MAYO': '05', 'JUNIO': '06',
-            'JULIO': '07', 'AGOSTO': '08', 'SEPTIEMBRE': '09', 'OCTUBRE': '10', 'NOVIEMBRE': '11', 'DICIEMBRE': '12'
-        }
-        
-        # Formatos estándar
-        formatos_estandar = [
-            '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y',
-            '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y'
-        ]
+        meses_es = _MESES_ES
+        formatos_estandar = _FORMATOS_FECHA
         
         # Intentar formatos estándar primero
         for formato in formatos_estandar:
@@ -71,6 +71,16 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Error inicializando base de datos: {e}")
 
+    # Precarga opcional de EasyOCR: la primera petición no paga la carga de modelos
+    if settings.OCR_WARMUP:
+        try:
+            # Reader compartido por Banorte, BBVA y Bajío (mismo readtext_batched que el OCR real)
+            from app.utils.ocr_common import warmup as ocr_warmup
+            ocr_warmup()
+            logger.info("✅ Modelos EasyOCR precargados (Banorte, BBVA y Bajío)")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron precargar los modelos EasyOCR: {e}")
+
     yield
     logger.info("🔄 Cerrando Sistema de Conciliación Bancaria...")
 
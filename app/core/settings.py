@@ -39,6 +39,9 @@ class Settings(BaseSettings):
     # === Logging ===
     LOG_LEVEL: str = "INFO"  # INFO, DEBUG, WARNING, ERROR, CRITICAL
 
+    # === OCR local ===
+    OCR_WARMUP: bool = False  # precarga EasyOCR (Banorte/BBVA/Bajío) y su pool de procesos al arrancar
+
     # Config de Pydantic Settings v2
     model_config = SettingsConfigDict(
         env_file=".env",
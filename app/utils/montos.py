@@ -0,0 +1,16 @@
+"""
+Conversión de montos a centavos enteros.
+
+El conciliador agrupa movimientos y CFDIs por monto y el servicio de archivos bancarios
+acumula saldos; ambos comparan en centavos enteros y deben convertir igual.
+"""
+
+from decimal import Decimal, ROUND_HALF_EVEN
+
+
+def centavos(monto) -> int:
+    """Monto (Decimal/float) en centavos enteros. Los Decimal de la BD se escalan de forma
+    exacta, sin pasar por float; los float se redondean al centavo más cercano."""
+    if isinstance(monto, Decimal):
+        return int(monto.scaleb(2).to_integral_value(rounding=ROUND_HALF_EVEN))
+    return int(round(float(monto) * 100))
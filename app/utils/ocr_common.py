@@ -0,0 +1,205 @@
+"""
+Piezas comunes de los lectores OCR de estados de cuenta (Banorte, BBVA, Bajío).
+
+El Reader de EasyOCR, el OCR en lote con readtext_batched y el reparto de páginas entre
+procesos viven aquí: así los tres lectores comparten un solo modelo por proceso y no se
+desalinean al cambiar uno de ellos.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from typing import Callable, Optional, Sequence
+
+import cv2
+import easyocr
+import numpy as np
+
+# Procesos para OCR en paralelo (cada uno carga su propio modelo EasyOCR)
+OCR_WORKERS = min(os.cpu_count() or 1, 6)
+
+# Con menos páginas que esto no se reparte entre procesos: el OCR va en el proceso actual
+OCR_POOL_MIN_PAGES = 4
+
+_READER = None
+_POOL = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+
+def gpu_available() -> bool:
+    """True si PyTorch (dependencia de EasyOCR) ve una GPU CUDA."""
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def get_reader():
+    """Reader EasyOCR único por proceso, creado al primer uso (no al importar el módulo):
+    los pesos CRAFT + CRNN se cargan una sola vez. Usa la GPU si hay CUDA disponible."""
+    global _READER
+    if _READER is None:
+        # quantize=True: en CPU EasyOCR aplica cuantización dinámica int8 a detector y reconocedor
+        _READER = easyocr.Reader(['es'], gpu=gpu_available(), quantize=True, cudnn_benchmark=True)
+        # warmup con la misma llamada que hace el OCR real (ocr_pages_batched)
+        _READER.readtext_batched([np.full((600, 800), 255, dtype=np.uint8)])
+    return _READER
+
+
+class TablaFiltro(dict):
+    """Tabla para str.translate: conserva los caracteres que cumplen `keep` y borra el resto.
+    Cada carácter se resuelve una vez y queda en la tabla."""
+    def __init__(self, keep):
+        super().__init__()
+        self.keep = keep
+
+    def __missing__(self, cp):
+        ch = chr(cp)
+        self[cp] = ch if self.keep(ch) else None
+        return self[cp]
+
+
+SOLO_DIGITOS = TablaFiltro(str.isdigit)
+
+
+def only_digits(s: str) -> str:
+    return s.translate(SOLO_DIGITOS)
+
+
+def text_line_height(img) -> Optional[float]:
+    """Mediana (px) de las corridas de filas con tinta de más de 4 px: ~altura de línea de texto.
+    None si la página no tiene texto. Acepta recortes en gris o BGR."""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    ink = (cv2.reduce(gray, 1, cv2.REDUCE_MIN).ravel() < 160).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ink, [0]))))
+    runs = edges[1::2] - edges[0::2]
+    runs = runs[runs > 4]
+    return float(np.median(runs)) if len(runs) else None
+
+
+def ocr_scale(img, target_line_h: Optional[float] = None, min_scale: float = 0.5,
+              max_width: Optional[int] = None) -> float:
+    """Factor de reducción (<= 1.0) de un recorte para el OCR (ver ocr_pages_batched).
+    Con target_line_h, las líneas de texto más altas se reducen a esa altura, sin bajar de
+    min_scale; con max_width, el recorte no pasa de ese ancho. Con ambos manda el menor."""
+    scale = 1.0
+    if target_line_h:
+        h_line = text_line_height(img)
+        if h_line:
+            scale = float(np.clip(target_line_h / h_line, min_scale, 1.0))
+    if max_width and img.shape[1] > max_width:
+        scale = min(scale, max_width / img.shape[1])
+    return scale
+
+
+def ocr_pages_batched(crops, reader, batch_size: int = 8, scales: Optional[Sequence[float]] = None):
+    """OCR de varias páginas con readtext_batched, de a `batch_size` páginas por llamada.
+    EasyOCR pasa todas las imágenes de una llamada por el detector CRAFT de una vez
+    (batch_size sólo limita al reconocedor), así que cada llamada recibe a lo más
+    `batch_size` páginas y la memoria del detector no crece con el largo del PDF.
+    Cada recorte se reduce por su escala (`scales`, de ocr_scale; 1.0 si no se da) y se rellena
+    (abajo/derecha, en blanco) al tamaño común de su tanda; las cajas se devuelven en
+    coordenadas del recorte original."""
+    if not crops:
+        return []
+    if scales is None:
+        scales = [1.0] * len(crops)
+    imgs = [
+        c if sc == 1.0 else
+        cv2.resize(c, (max(1, round(c.shape[1] * sc)), max(1, round(c.shape[0] * sc))),
+                   interpolation=cv2.INTER_AREA)
+        for c, sc in zip(crops, scales)
+    ]
+    results_list = []
+    for start in range(0, len(imgs), batch_size):
+        tanda = imgs[start:start + batch_size]
+        max_h = max(img.shape[0] for img in tanda)
+        max_w = max(img.shape[1] for img in tanda)
+        padded = [
+            img if img.shape[:2] == (max_h, max_w) else
+            cv2.copyMakeBorder(img, 0, max_h - img.shape[0], 0, max_w - img.shape[1],
+                               cv2.BORDER_CONSTANT, value=(255, 255, 255))
+            for img in tanda
+        ]
+        results_list.extend(reader.readtext_batched(padded, n_width=max_w, n_height=max_h,
+                                                    batch_size=batch_size, detail=1,
+                                                    paragraph=False))
+    for k, sc in enumerate(scales):
+        if sc != 1.0:
+            results_list[k] = [([[x / sc, y / sc] for x, y in bb], txt, conf)
+                               for bb, txt, conf in results_list[k]]
+    return results_list
+
+
+def _init_worker():
+    """Inicializador de los procesos del pool: un solo hilo de PyTorch por proceso (los
+    workers ya se reparten los núcleos) y el Reader cargado antes de la primera página."""
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    get_reader()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool de procesos del módulo, reutilizado entre PDFs: cada worker carga el modelo una
+    sola vez. Sólo se recrea si se piden más workers de los que tiene.
+    Los workers arrancan con "spawn", no con fork: el proceso del servidor tiene hilos (y quizá
+    torch/OpenMP/OpenCL ya cargados) y un fork de eso puede dejar workers colgados;
+    _init_worker arma todo lo que el worker necesita."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or workers > _POOL_WORKERS:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)   # termina lo ya enviado y libera sus procesos
+            _POOL = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            _POOL_WORKERS = workers
+        return _POOL
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    """Descarta el pool si un worker murió (BrokenProcessPool): el siguiente PDF crea otro."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL, _POOL_WORKERS = None, 0
+
+
+def warmup():
+    """Carga el Reader en este proceso y arranca el pool de OCR (cada worker carga el suyo en
+    _init_worker), para que el primer PDF de cualquier banco no pague la carga de modelos."""
+    get_reader()
+    if OCR_WORKERS > 1 and not gpu_available():
+        pool = _get_pool(OCR_WORKERS)
+        for fut in [pool.submit(os.getpid) for _ in range(OCR_WORKERS)]:
+            fut.result()
+
+
+def map_page_chunks(fn: Callable, pages: Sequence, *args, workers: Optional[int] = None) -> list:
+    """Aplica fn(primera_pagina, bloque, *args) a bloques contiguos de `pages` y junta, en
+    orden, las listas (un elemento por página) que devuelve. Con varios workers los bloques
+    se reparten en el pool del módulo; con GPU o con pocas páginas (OCR_POOL_MIN_PAGES) todo
+    va en este proceso (el contexto CUDA no se comparte entre procesos).
+    `fn` debe ser una función de módulo (se envía por pickle)."""
+    if not pages:
+        return []
+    workers = max(1, min(workers or OCR_WORKERS, len(pages)))
+    if workers == 1 or len(pages) < OCR_POOL_MIN_PAGES or gpu_available():
+        return fn(1, pages, *args)
+    bounds = np.linspace(0, len(pages), workers + 1).astype(int)
+    firsts = [int(a) + 1 for a in bounds[:-1]]
+    chunks = [pages[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    pool = _get_pool(workers)
+    try:
+        parts = pool.map(fn, firsts, chunks, *(repeat(a) for a in args))
+        return [item for part in parts for item in part]
+    except BrokenProcessPool:
+        _drop_pool(pool)
+        raise
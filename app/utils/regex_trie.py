@@ -0,0 +1,41 @@
+"""
+Construcción de expresiones regulares tipo trie para listas de palabras clave.
+
+Una alternancia plana ("CARGO|COMISION|COMPRA|...") obliga al motor de `re` a probar
+cada palabra en cada posición. Factorizando prefijos comunes ("C(?:ARGO|OM(?:ISION|PRA))")
+cada posición se descarta con una sola comparación de carácter.
+"""
+
+import re
+from typing import Iterable
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Devuelve un patrón equivalente a la alternancia de `words` con prefijos factorizados."""
+    trie: dict = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    return _trie_to_pattern(trie) if trie else "(?!)"
+
+
+def _trie_to_pattern(node: dict) -> str:
+    alts, chars = [], []
+    for ch in sorted(k for k in node if k):
+        sub = _trie_to_pattern(node[ch])
+        if sub:
+            alts.append(re.escape(ch) + sub)
+        else:
+            chars.append(re.escape(ch))
+    if chars:
+        alts.append(chars[0] if len(chars) == 1 else "[" + "".join(chars) + "]")
+    if not alts:
+        return ""
+    pattern = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+    if "" in node:
+        pattern = "(?:" + pattern + ")?"
+    return pattern